@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [REPOSITORY, os.path.join(REPOSITORY, 'catalog')]
+from benchmarks.synthetic_tree import generate_tree
+from discovery import find_simulations
+from extraction import read_simulations_parameters
+from storage import json_storage, sqlite_storage
+from Tools.Tools import SimulationAnalysis
+
+
+def read_bytes():
+    """
+    Bytes read by the process so far, from /proc/self/io (Linux only).
+    """
+    try:
+        with open('/proc/self/io') as io:
+            for line in io:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+def measure(name, function, items):
+    """
+    Runs function on every item, recording the wall time, the bytes read
+    and the peak of the memory allocated.
+    """
+    bytes_before = read_bytes()
+    tracemalloc.start()
+    start = time.perf_counter()
+    results = [function(item) for item in items]
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    bytes_after = read_bytes()
+    report = {"benchmark": name, "items": len(items), "seconds": seconds,
+              "items_per_second": len(items) / seconds if seconds > 0 else None,
+              "MB_read": None if bytes_before is None else (bytes_after - bytes_before) / 1024 ** 2,
+              "peak_memory_MB": peak / 1024 ** 2}
+    return results, report
+
+def benchmark_discovery(root, concurrency = 1):
+    found, report = measure("discovery (%d threads)" % concurrency,
+                            lambda path: list(find_simulations([path], verbose = False,
+                                                               concurrency = concurrency)), [root])
+    report["items"] = len(found[0])
+    report["items_per_second"] = len(found[0]) / report["seconds"] if report["seconds"] > 0 else None
+    return report
+
+def benchmark_extraction(simulations):
+    return measure("read_simulations_parameters",
+                   lambda simulation: read_simulations_parameters(*simulation), simulations)
+
+def benchmark_readers(simulations):
+    reports = []
+    analyses, report = measure("SimulationAnalysis", lambda simulation: SimulationAnalysis(*simulation),
+                               simulations)
+    reports.append(report)
+    def first_snapshot(function):
+        def run(sim):
+            data_h5 = sim.open_h5(sim.file_list_hdf()[0])
+            try:
+                return function(sim, data_h5)
+            finally:
+                sim.close_h5(data_h5)
+        return run
+    readers = {"omega": first_snapshot(lambda sim, data_h5: sim.omega(data_h5)),
+               "angular_average omega": first_snapshot(lambda sim, data_h5: \
+                                                       sim.angular_average('omega', data_h5)),
+               "poloidal_magnetic_field": first_snapshot(lambda sim, data_h5: \
+                                                         sim.poloidal_magnetic_field(data_h5)),
+               "timeline": lambda sim: sim.timeline().last_readable_snapshot(),
+               "time_of_bounce_rho": lambda sim: sim.time_of_bounce_rho()}
+    for name, reader in readers.items():
+        reports.append(measure(name, reader, analyses)[1])
+    return reports
+
+def benchmark_storage(entries, n_entries, folder):
+    catalog = [dict(entries[index % len(entries)], name = 'sim%07d' % index) for index in range(n_entries)]
+    reports = []
+    for storage in (json_storage(os.path.join(folder, 'catalog.json')),
+                    sqlite_storage(os.path.join(folder, 'catalog.sqlite'))):
+        name = type(storage).__name__
+        reports.append(measure(name + " save", storage.save, [catalog])[1])
+        reports.append(measure(name + " load", lambda storage: list(storage.load()), [storage])[1])
+        reports.append(measure(name + " single entry commit",
+                               lambda entry: storage.commit(catalog, [entry], []), catalog[:1])[1])
+    return reports
+
+def print_reports(reports):
+    print("%-40s %8s %10s %12s %10s %12s" % ("benchmark", "items", "seconds", "items/s", "MB read",
+                                             "peak MB"))
+    for report in reports:
+        print("%-40s %8d %10.4f %12s %10s %12.2f" % (report["benchmark"], report["items"], report["seconds"],
+              "-" if report["items_per_second"] is None else "%.2f" % report["items_per_second"],
+              "-" if report["MB_read"] is None else "%.2f" % report["MB_read"], report["peak_memory_MB"]))
+
+parser = argparse.ArgumentParser(description="Benchmarks of the catalog build on a synthetic simulation tree.")
+parser.add_argument('--root', type=str, default=None,
+                    help="Folder in which to create the temporary folder holding the tree.")
+parser.add_argument('--keep-tree', action='store_true', default=False,
+                    help="Do not delete the generated tree at the end.")
+parser.add_argument('--simulations', type=int, default=10,
+                    help="Number of simulations to generate.")
+parser.add_argument('--dim', type=int, default=2, choices=[1, 2, 3],
+                    help="Dimension of the simulations.")
+parser.add_argument('--nx', type=int, default=64)
+parser.add_argument('--ny', type=int, default=32)
+parser.add_argument('--nz', type=int, default=16)
+parser.add_argument('--files', type=int, default=10,
+                    help="Number of outp-hdf snapshots per simulation.")
+parser.add_argument('--depth', type=int, default=2,
+                    help="Nesting depth of the simulation folders.")
+parser.add_argument('--discovery-threads', type=int, default=8,
+                    help="Number of threads of the concurrent discovery benchmark.")
+parser.add_argument('--catalog-entries', type=int, default=10000,
+                    help="Number of entries of the catalog used for the save/load benchmarks.")
+parser.add_argument('--output', type=str, default=None,
+                    help="Path of a JSON file in which to write the results.")
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    root = tempfile.mkdtemp(prefix='ccsn_benchmark_', dir=args.root)
+    try:
+        simulations = generate_tree(os.path.join(root, 'tree'), args.simulations, args.depth,
+                                    dim = args.dim, nx = args.nx, ny = args.ny, nz = args.nz,
+                                    n_files = args.files)
+        reports = [benchmark_discovery(os.path.join(root, 'tree'), concurrency) \
+                   for concurrency in sorted({1, args.discovery_threads})]
+        entries, report = benchmark_extraction(simulations)
+        reports.append(report)
+        reports.extend(benchmark_readers(simulations))
+        reports.extend(benchmark_storage(entries, args.catalog_entries, root))
+        print_reports(reports)
+        if args.output is not None:
+            with open(args.output, 'w') as outfile:
+                json.dump({"parameters": vars(args), "results": reports}, outfile, indent=4)
+    finally:
+        if args.keep_tree:
+            print("Tree kept in", root)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
@@ -0,0 +1,107 @@
+import os
+import numpy as np
+import h5py
+
+START_PARS = """&IINDICES
+ I_VELZ = 4
+/
+&GRIDPARS
+ STENCIL = {ghost}
+/
+&PHYSSYST
+ RELATIVISTIC = {relativistic}
+/
+&GRAVPARS
+ MDPOT = 'A'
+ LAPSE_FORM = 2
+/
+&SHENEOSPARS
+ SHEN_TBFILE = '/eos/tables/{eos}.h5'
+/
+"""
+MAGNETIC_PARS = """&AXIVECPOTPARS
+ b0 = {b0}
+ bt = {bt}
+/
+"""
+HEGER_PARS = """&HEGERPARS
+ HEGER_MODEL = '/progenitors/{model}'
+/
+"""
+HYDRO_PARS = """&HYDROPARS
+ CFL = 0.5
+ RECONSTRUCTION = 'PPM'
+/
+"""
+
+
+def write_grid(path, n_cells, lower, upper):
+    """
+    Writes a grid file with the index, left, center and right coordinate of
+    each cell, as in the grid/grid.*.dat files.
+    """
+    edges = np.linspace(lower, upper, n_cells + 1)
+    np.savetxt(path, np.c_[np.arange(n_cells), edges[:-1], 0.5 * (edges[:-1] + edges[1:]), edges[1:]])
+
+def write_rho_log(path, n_lines, bounce_time = 0.25, total_time = 1.0):
+    """
+    Writes a log/rho.dat whose maximum density crosses 2.5e14 g/cm3 at the
+    bounce time.
+    """
+    time = np.linspace(0, total_time, n_lines)
+    rho = np.where(time < bounce_time, 1e10 * np.exp(np.log(2.4e4) * time / bounce_time), 3e14)
+    np.savetxt(path, np.c_[np.arange(n_lines), np.zeros(n_lines), time, rho, np.ones(n_lines)])
+
+def make_simulation(path, dim = 2, nx = 64, ny = 32, nz = 16, ghost = 4, n_files = 10,
+                    magnetic_fields = True, rho_lines = 10000, n_variables = 6, seed = 0):
+    """
+    Creates a fake Aenus-ALCAR simulation folder with outp-hdf snapshots
+    (Parameters/t, thd/data and mag_vol/data), grid files, parfiles and the
+    density log.
+    """
+    assert dim in (1, 2, 3), "Supernova simulation can either be 1D, 2D or 3D"
+    for folder in ('outp-hdf', 'grid', 'log', os.path.join('pars', '.run')):
+        os.makedirs(os.path.join(path, folder), exist_ok=True)
+    write_grid(os.path.join(path, 'grid', 'grid.x.dat'), nx + 2 * ghost, 1e5, 1e9)
+    write_grid(os.path.join(path, 'grid', 'grid.y.dat'), ny + 2 * ghost if dim > 1 else 1, 0, np.pi)
+    write_grid(os.path.join(path, 'grid', 'grid.z.dat'), nz + 2 * ghost if dim > 2 else 1, 0, 2 * np.pi)
+    with open(os.path.join(path, 'pars', 'start.pars'), 'w') as parfile:
+        parfile.write(START_PARS.format(ghost = ghost, relativistic = '.true.', eos = 'SFHo'))
+        if magnetic_fields:
+            parfile.write(MAGNETIC_PARS.format(b0 = 1e12, bt = 1e11))
+    with open(os.path.join(path, 'pars', 'hydro.pars'), 'w') as parfile:
+        parfile.write(HYDRO_PARS)
+    with open(os.path.join(path, 'pars', '.run', 'heger.pars'), 'w') as parfile:
+        parfile.write(HEGER_PARS.format(model = 's15.0'))
+    write_rho_log(os.path.join(path, 'log', 'rho.dat'), rho_lines)
+    shape = (nz + 2 * ghost if dim > 2 else 1, ny + 2 * ghost if dim > 1 else 1, nx + 2 * ghost)
+    rng = np.random.default_rng(seed)
+    for index in range(n_files):
+        with h5py.File(os.path.join(path, 'outp-hdf', 'h%05d.h5' % index), 'w') as data_h5:
+            data_h5.create_dataset('Parameters/t', data = np.array([1e-3 * index]))
+            data_h5.create_dataset('thd/data', data = rng.random(shape + (n_variables,)))
+            if magnetic_fields:
+                data_h5.create_dataset('mag_vol/data', data = rng.random(shape + (3,)))
+    #files not starting with h are skipped by the catalog
+    open(os.path.join(path, 'outp-hdf', 'x00000.h5'), 'w').close()
+
+def generate_tree(root, n_simulations = 10, depth = 2, branching = 3, **simulation_kwargs):
+    """
+    Creates n_simulations fake simulations under root, spread over nested
+    project folders depth levels deep, with Initial_Models and EOS folders
+    and empty folders in between, as in a real storage tree.
+    Returns the list of (name, location) pairs of the simulations.
+    """
+    simulations = []
+    for index in range(n_simulations):
+        location = root
+        node = index
+        for level in range(depth):
+            location = os.path.join(location, 'level%d_%d' % (level, node % branching))
+            node //= branching
+        name = 'sim%04d' % index
+        make_simulation(os.path.join(location, name), seed = index, **simulation_kwargs)
+        simulations.append((name, location))
+    for folder in ('Initial_Models', 'EOS', 'empty'):
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+    return simulations
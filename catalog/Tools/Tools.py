@@ -1,12 +1,19 @@
 import numpy as np
 import os
+import itertools
+import hashlib
 from typing import Literal
 import h5py
 from Tools.parameters import get_indices_from_parfile as getPar
+from Tools.profiling import stage, count_open
 
 
 class SimulationAnalysis:
-    def __init__(self, simulation_name, simulation_folder_path):
+    #Maximum number of bytes of raw data read at once by the chunked readers
+    memory_budget = 256 * 1024 ** 2
+
+    def __init__(self, simulation_name, simulation_folder_path, memory_budget = None,
+                 grid_cache = None):
         self.simulation_name = simulation_name
         self.path = os.path.join(simulation_folder_path, self.simulation_name)
         self.log_path = os.path.join(self.path, 'log')
@@ -14,17 +21,21 @@ class SimulationAnalysis:
         self.grid_path = os.path.join(self.path, 'grid')
         self.par_path = os.path.join(self.path, 'pars')
         self.rho_max_file = 'rho.dat'
-        self.hydroTHD_index, self.ghost_cells = getPar('start.pars', self.par_path)
-        self.cell = cell(self.path, None)
+        with stage('start.pars'):
+            self.hydroTHD_index, self.ghost_cells = getPar('start.pars', self.par_path)
+        with stage('grid dimension'):
+            self.cell = cell(self.path, None, grid_cache)
         self.dim = self.cell.simulation_dimension()
         self.ghost = ghost(self.ghost_cells)
+        if memory_budget is not None:
+            self.memory_budget = memory_budget
+        self.__timeline = None
 
     def time_of_bounce_rho(self):
-        rho_data = self.__rho_max()
-        rho_index = np.argmax(rho_data[:,1]>2.5e14)
-        if rho_index == 0 or rho_data[rho_index, 0] >= 0.6:
-            rho_index = np.argmax(rho_data[:,1]>2e14)
-        return rho_data[rho_index, 0]
+        return self.rho_log().bounce_time()
+
+    def rho_log(self):
+        return rho_log(os.path.join(self.log_path, self.rho_max_file))
 
     def file_list_hdf(self):
         file_list = os.listdir(self.hdf_path)
@@ -34,60 +45,306 @@ class SimulationAnalysis:
         file_list.sort()
         return file_list
     
+    def timeline(self):
+        """
+        Returns the timeline of the simulation outputs, built on first use.
+        """
+        if self.__timeline is None:
+            self.__timeline = timeline(self.hdf_path)
+        return self.__timeline
+
     def open_h5(self, file_name):
         file_path = os.path.join(self.hdf_path, file_name)
+        count_open()
         return h5py.File(file_path)
     
     def close_h5(self, data_h5):
         data_h5.close()
 
     def poloidal_magnetic_field(self, data_h5):
-        data = self.__magnetic_field(data_h5)
-        return np.sqrt(data[...,0]**2+data[...,1]**2)
+        return self.__poloidal(self.__read_interior(data_h5['mag_vol']['data'], slice(0, 2)))
 
     def toroidal_magnetic_field(self, data_h5):
-        return self.__magnetic_field(data_h5)[...,2]
+        return self.__read_interior(data_h5['mag_vol']['data'], 2)
     
     def time(self, data_h5):
         return np.array(data_h5['Parameters']['t'])
     
     def omega(self, data_h5):
-        v_phi = self.__phi_velocity(data_h5)
+        return self.__omega(self.__phi_velocity(data_h5))
+
+    def angular_average(self, quantity: Literal['omega', 'poloidal_magnetic_field',
+                                                'toroidal_magnetic_field'], data_h5):
+        """
+        Radial profile of a quantity averaged over the polar and azimuthal
+        angles. The interior cells are read in chunks along the outermost
+        angular axis, so that no more than memory_budget bytes of raw data
+        are loaded at once.
+        """
+        with stage('angular average'):
+            return self.__angular_average(quantity, data_h5)
+
+    def __angular_average(self, quantity, data_h5):
+        group, variables, convert = self.__quantity(quantity)
+        dataset = data_h5[group]['data']
+        selection = self.ghost.hyperslab(dataset.shape[:-1], self.dim)
+        if self.dim == 1 or selection is None:
+            data = convert(self.__read_interior(dataset, variables))
+            if self.dim == 1:
+                return data
+            return data.mean(axis = tuple(range(self.dim - 1)))
+        sizes = [sl.stop - sl.start for sl in selection if type(sl) == slice]
+        n_variables = len(range(dataset.shape[-1])[variables]) if type(variables) == slice else 1
+        plane_bytes = int(np.prod(sizes[1:])) * n_variables * dataset.dtype.itemsize
+        step = max(1, self.memory_budget // plane_bytes)
+        profile = np.zeros(sizes[-1])
+        for start in range(0, sizes[0], step):
+            chunk = slice(start, min(start + step, sizes[0]))
+            data = convert(self.__read_interior(dataset, variables, chunk), chunk)
+            profile += data.sum(axis = tuple(range(self.dim - 1)), dtype = np.float64)
+        return profile / np.prod(sizes[:-1])
+
+    def __quantity(self, quantity):
+        """
+        Returns the HDF5 group, the variables to read and the function turning
+        them into the requested quantity.
+        """
+        if quantity == 'omega':
+            return 'thd', self.hydroTHD_index['thd']['I_VELZ'], self.__omega
+        if quantity == 'poloidal_magnetic_field':
+            return 'mag_vol', slice(0, 2), lambda data, chunk = None: self.__poloidal(data)
+        if quantity == 'toroidal_magnetic_field':
+            return 'mag_vol', 2, lambda data, chunk = None: data
+        raise TypeError("Quantity not recognized: " + str(quantity))
+
+    def __read_interior(self, dataset, variables, chunk = None):
+        """
+        Reads the selected variables of the interior cells of an HDF5 dataset.
+        Ghost cells are removed at read time through a hyperslab selection;
+        chunk further restricts the outermost angular axis (interior indices).
+        """
+        with stage('hdf5 read'):
+            return self.__read_selection(dataset, variables, chunk)
+
+    def __read_selection(self, dataset, variables, chunk):
+        selection = self.ghost.hyperslab(dataset.shape[:-1], self.dim)
+        if selection is None:
+            assert chunk is None, "Chunked reads need a dataset matching the simulation dimension"
+            return self.ghost.remove_ghost_cells(np.squeeze(np.array(dataset)[..., variables]),
+                                                 self.dim)
+        if chunk is not None:
+            selection = list(selection)
+            axis = [type(sl) for sl in selection].index(slice)
+            selection[axis] = slice(selection[axis].start + chunk.start,
+                                    selection[axis].start + chunk.stop)
+            selection = tuple(selection)
+        return dataset[selection + (variables,)]
+
+    def __omega(self, v_phi, chunk = None):
+        if chunk is None:
+            chunk = slice(None)
         radius = self.cell.radius(self.ghost)
         if self.dim == 1:
             return v_phi / radius[None, :]
         theta = np.sin(self.cell.theta(self.ghost))
         if self.dim == 2:
-            return v_phi / (theta[:, None] * radius[None, :])
+            return v_phi / (theta[chunk, None] * radius[None, :])
         if self.dim == 3:
             phi = np.cos(self.cell.phi(self.ghost))
-            return v_phi / (phi[:, None, None] * theta[None, :, None] * radius[None, None, :])
+            return v_phi / (phi[chunk, None, None] * theta[None, :, None] * radius[None, None, :])
+
+    def __poloidal(self, data):
+        return np.sqrt(data[...,0]**2+data[...,1]**2)
     
     def __phi_velocity(self, data_h5):
-        data = np.array(data_h5['thd']['data'])[:,:,:,self.hydroTHD_index['thd']['I_VELZ']]
-        return self.ghost.remove_ghost_cells(np.squeeze(data), self.dim)
+        return self.__read_interior(data_h5['thd']['data'], self.hydroTHD_index['thd']['I_VELZ'])
+
+class rho_log:
+    """
+    Reader of the maximum density log (log/rho.dat), whose third and fourth
+    columns are the time and the maximum density. The file is parsed in
+    blocks of lines, so only the part needed to find the bounce is read.
+    """
+    def __init__(self, path, block_lines = 65536):
+        self.path = path
+        self.block_lines = block_lines
+
+    def blocks(self):
+        """
+        Yields (time, rho) arrays, one block of lines at a time.
+        """
+        with open(self.path) as log:
+            while True:
+                lines = list(itertools.islice(log, self.block_lines))
+                if not lines:
+                    return
+                data = np.loadtxt(lines, usecols=(2, 3), ndmin=2)
+                if data.size:
+                    yield data[:, 0], data[:, 1]
+
+    def bounce_time(self):
+        """
+        Time at which the maximum density first exceeds 2.5e14 g/cm3. If this
+        happens at the very first line or after 0.6 s, the time at which it
+        exceeds 2e14 g/cm3 is used instead. The reading stops as soon as the
+        first threshold is crossed.
+        """
+        with stage('rho log'):
+            return self.__bounce_time()
+
+    def __bounce_time(self):
+        first_time, time_2e14 = None, None
+        for time, rho in self.blocks():
+            if first_time is None:
+                first_time, first_line = time[0], True
+            else:
+                first_line = False
+            if time_2e14 is None and (rho > 2e14).any():
+                time_2e14 = time[np.argmax(rho > 2e14)]
+            if (rho > 2.5e14).any():
+                index = np.argmax(rho > 2.5e14)
+                if (index == 0 and first_line) or time[index] >= 0.6:
+                    return time_2e14
+                return time[index]
+        if first_time is None:
+            raise ValueError("Empty density log: " + self.path)
+        return first_time if time_2e14 is None else time_2e14
+
+    def last_line(self, block_size = 4096):
+        """
+        Returns the (time, rho) of the last line of the log, reading only the
+        end of the file.
+        """
+        with open(self.path, 'rb') as log:
+            log.seek(0, os.SEEK_END)
+            end = log.tell()
+            size = min(block_size, end)
+            while True:
+                log.seek(end - size)
+                lines = log.read(size).split(b'\n')
+                lines = [line for line in lines[1 if size < end else 0:] \
+                         if line.strip() and not line.lstrip().startswith(b'#')]
+                if lines or size == end:
+                    break
+                size = min(2 * size, end)
+        if not lines:
+            raise ValueError("Empty density log: " + self.path)
+        columns = lines[-1].split()
+        return float(columns[2]), float(columns[3])
+
+    def latest_time(self):
+        return self.last_line()[0]
+
+class timeline:
+    """
+    Sorted list of the hdf output files of a simulation, together with
+    their first and last modification time, all collected in a single
+    scandir pass. The last readable snapshot is searched lazily.
+    """
+    def __init__(self, hdf_path):
+        self.hdf_path = hdf_path
+        with stage('timeline scan'):
+            self.file_list, self.first_mtime, self.last_mtime = self.__scan()
+        self.__last_readable = None
+        self.__searched = False
+
+    def __scan(self):
+        files, first_mtime, last_mtime = [], None, None
+        with os.scandir(self.hdf_path) as entries:
+            for entry in entries:
+                #remove x00 files
+                if not entry.name.startswith('h'):
+                    continue
+                files.append(entry.name)
+                mtime = entry.stat().st_mtime
+                if first_mtime is None or mtime < first_mtime:
+                    first_mtime = mtime
+                if last_mtime is None or mtime > last_mtime:
+                    last_mtime = mtime
+        files.sort()
+        return files, first_mtime, last_mtime
+
+    def snapshot_time(self, file_name):
+        """
+        Reads only the Parameters/t attribute of a snapshot. Returns None if
+        the file cannot be read.
+        """
+        count_open()
+        try:
+            with h5py.File(os.path.join(self.hdf_path, file_name), 'r') as data_h5:
+                return float(data_h5['Parameters']['t'][0])
+        except Exception:
+            return None
+
+    def last_readable_snapshot(self):
+        """
+        Returns (index, time) of the last snapshot that can be read, or None.
+        Unreadable files are assumed to be at the end of the list (e.g. files
+        still being written): the search steps backwards with doubling strides
+        until a readable file is found, then bisects the gap, so only
+        O(log N) files are opened.
+        """
+        if not self.__searched:
+            with stage('last readable snapshot'):
+                self.__last_readable = self.__search_last_readable()
+            self.__searched = True
+        return self.__last_readable
+
+    def __search_last_readable(self):
+        n_files = len(self.file_list)
+        readable, unreadable, offset = None, n_files, 1
+        while readable is None and unreadable > 0:
+            index = max(n_files - offset, 0)
+            time = self.snapshot_time(self.file_list[index])
+            if time is None:
+                unreadable = index
+            else:
+                readable = (index, time)
+            offset *= 2
+        if readable is None:
+            return None
+        while unreadable - readable[0] > 1:
+            index = (readable[0] + unreadable) // 2
+            time = self.snapshot_time(self.file_list[index])
+            if time is None:
+                unreadable = index
+            else:
+                readable = (index, time)
+        return readable
+
+    def unreadable_files(self):
+        """
+        Number of trailing snapshots that cannot be read.
+        """
+        last_readable = self.last_readable_snapshot()
+        if last_readable is None:
+            return len(self.file_list)
+        return len(self.file_list) - 1 - last_readable[0]
+
+    def total_time(self):
+        last_readable = self.last_readable_snapshot()
+        if last_readable is None:
+            return None
+        return last_readable[1]
 
-    def __rho_max(self):
-        rho =  np.loadtxt(os.path.join(self.log_path, self.rho_max_file), 
-                          usecols=(2, 3))
-        return rho
-    
-    def __magnetic_field(self, data_h5):
-        return self.ghost.remove_ghost_cells(np.squeeze(np.array(data_h5['mag_vol']['data'])),
-                                             self.dim)
-    
 class cell:
-    def __init__(self, path_folder, dim=None):
+    """
+    Grid of the simulation. Each grid file is loaded on first use only. If a
+    cache_dir is given, parsed grids are stored there as .npy files, keyed by
+    path, modification time and size, and later memory-mapped instead of
+    parsing the text again. Each grid file has its own folder in the cache,
+    so the stale versions of a grid are removed when it is parsed again.
+    """
+    def __init__(self, path_folder, dim=None, cache_dir=None):
         assert dim in (1, 2, 3, None), "Supernova simulation can either be 1D, 2D or 3D"
         self.path_grid = os.path.join(path_folder, 'grid')
-        self.__radius_file = np.loadtxt(os.path.join(self.path_grid, 'grid.x.dat'))
-        self.__theta_file = np.loadtxt(os.path.join(self.path_grid, 'grid.y.dat'))
-        self.__phi_file = np.loadtxt(os.path.join(self.path_grid, 'grid.z.dat'))
+        self.cache_dir = cache_dir
+        self.__grids = {}
         if dim is None:
             dim = 1
-            if (self.__theta_file).size > 4:
+            if self.__grid_size_exceeds('y', 4):
                 dim += 1
-            if (self.__phi_file).size > 4:
+            if self.__grid_size_exceeds('z', 4):
                 dim += 1
         self.dim = dim
 
@@ -95,17 +352,83 @@ class cell:
         return self.dim
 
     def radius(self, ghost):
-        return ghost.remove_ghost_cells(self.__radius_file[:, 2], self.dim, 'radius')
+        return ghost.remove_ghost_cells(self.__grid('x')[:, 2], self.dim, 'radius')
 
     def dr(self, ghost):
-        return ghost.remove_ghost_cells(self.__radius_file[:, 3], self.dim, 'radius') - \
-            ghost.remove_ghost_cells(self.__radius_file[:, 1], self.dim, 'radius')
+        return ghost.remove_ghost_cells(self.__grid('x')[:, 3], self.dim, 'radius') - \
+            ghost.remove_ghost_cells(self.__grid('x')[:, 1], self.dim, 'radius')
 
     def theta(self, ghost):
-        return ghost.remove_ghost_cells(self.__theta_file[:, 2], self.dim, 'theta')
+        return ghost.remove_ghost_cells(self.__grid('y')[:, 2], self.dim, 'theta')
     
     def phi(self, ghost):
-        return ghost.remove_ghost_cells(self.__phi_file[:, 2], self.dim, 'phi')
+        return ghost.remove_ghost_cells(self.__grid('z')[:, 2], self.dim, 'phi')
+
+    def __grid_file(self, axis):
+        return os.path.join(self.path_grid, 'grid.' + axis + '.dat')
+
+    def __grid(self, axis):
+        if axis not in self.__grids:
+            self.__grids[axis] = self.__load_grid(axis)
+        return self.__grids[axis]
+
+    def __grid_size_exceeds(self, axis, size):
+        """
+        Checks whether a grid file holds more than size values, reading only
+        its first lines.
+        """
+        if axis in self.__grids:
+            return self.__grids[axis].size > size
+        values = 0
+        with open(self.__grid_file(axis)) as grid_file:
+            for line in grid_file:
+                if line.lstrip().startswith('#'):
+                    continue
+                values += len(line.split())
+                if values > size:
+                    return True
+        return False
+
+    def __cache_file(self, path):
+        if self.cache_dir is None:
+            return None
+        stat = os.stat(path)
+        key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key, str(stat.st_mtime_ns) + '_' + str(stat.st_size) + '.npy')
+
+    def __load_grid(self, axis):
+        path = self.__grid_file(axis)
+        cache_file = self.__cache_file(path)
+        if cache_file is not None and os.path.exists(cache_file):
+            try:
+                return np.load(cache_file, mmap_mode='r')
+            except (OSError, ValueError):
+                pass
+        with stage('grid loadtxt'):
+            grid = np.loadtxt(path)
+        if cache_file is not None:
+            try:
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                tmp_file = cache_file + '.' + str(os.getpid()) + '.tmp'
+                with open(tmp_file, 'wb') as outfile:
+                    np.save(outfile, grid)
+                os.replace(tmp_file, cache_file)
+                self.__remove_stale(cache_file)
+            except OSError:
+                pass
+        return grid
+
+    def __remove_stale(self, cache_file):
+        """
+        Removes the versions of a cached grid superseded by cache_file.
+        """
+        folder = os.path.dirname(cache_file)
+        for name in os.listdir(folder):
+            if name != os.path.basename(cache_file) and name.endswith('.npy'):
+                try:
+                    os.remove(os.path.join(folder, name))
+                except OSError:
+                    pass
 
 class ghost:
     def __init__(self, ghost_cells):
@@ -146,6 +469,23 @@ class ghost:
     def return_ghost_dictionary(self):
         return self.__options_1D
 
+    def hyperslab(self, shape, dim):
+        """
+        Selection of the interior cells of a (phi, theta, radius) shaped dataset,
+        to be applied at read time. Singleton axes are dropped, as np.squeeze
+        would do, and ghost cells are removed along the others.
+        Returns None if the shape does not match the dimension of the simulation.
+        """
+        assert dim in (1, 2, 3), "Simulation MUST be 1, 2 or 3D"
+        axes = [axis for axis, size in enumerate(shape) if size > 1]
+        if len(axes) != dim:
+            return None
+        selection = [0] * len(shape)
+        for axis, quantity in zip(axes, ['phi', 'theta', 'radius'][3 - dim:]):
+            boundaries = self.__options_1D[quantity]
+            selection[axis] = slice(boundaries[0], shape[axis] - boundaries[1])
+        return tuple(selection)
+
     def remove_ghost_cells(self, array, dim, quantity_1D: 
                            Literal['radius', 'theta', 'phi'] = None):
         assert dim in (1, 2, 3), "Simulation MUST be 1, 2 or 3D"
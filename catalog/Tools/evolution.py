@@ -0,0 +1,73 @@
+import os
+import functools
+import numpy as np
+from Tools.snapshots import index_file, snapshot_table
+
+QUANTITIES = ('omega', 'poloidal_magnetic_field', 'toroidal_magnetic_field')
+
+
+def series_file(series_dir, hdf_path):
+    """
+    Path of the time series of an outp-hdf folder inside series_dir.
+    """
+    return index_file(series_dir, hdf_path)[:-len('.npy')] + '.evolution.npy'
+
+def _snapshot_summaries(simulation_name, simulation_path, memory_budget, backend, file_names):
+    """
+    Reads the time and the maxima of the angle averaged omega, poloidal and
+    toroidal magnetic fields of each file, one file at a time, with the
+    analysis backend of the build. With the bundled Tools the averages are
+    computed by the chunked reader, so no more than memory_budget bytes of
+    raw data are loaded at once. NaN for what cannot be read.
+    """
+    from extraction import analysis_backend, radial_profile
+    sim = analysis_backend(backend)(simulation_name, simulation_folder_path = simulation_path)
+    if memory_budget is not None:
+        sim.memory_budget = memory_budget
+    summaries = []
+    for file_name in file_names:
+        summary = [np.nan] * (1 + len(QUANTITIES))
+        try:
+            data_h5 = sim.open_h5(file_name)
+        except Exception:
+            summaries.append(tuple(summary))
+            continue
+        try:
+            summary[0] = float(sim.time(data_h5)[0])
+            for position, quantity in enumerate(QUANTITIES):
+                try:
+                    summary[position + 1] = float(radial_profile(sim, quantity, data_h5).max())
+                except Exception:
+                    pass
+        except Exception:
+            pass
+        finally:
+            sim.close_h5(data_h5)
+        summaries.append(tuple(summary))
+    return summaries
+
+class evolution_series(snapshot_table):
+    """
+    Time evolution of a simulation: time and maxima of the angle averaged
+    omega, poloidal and toroidal magnetic fields of every stride-th hdf
+    output file, updated incrementally as the snapshot index. Each worker
+    holds a single snapshot at a time.
+    """
+    fields = [("time", 'f8'), ("omega", 'f8'), ("poloidal_b_field", 'f8'), ("toroidal_b_field", 'f8')]
+    chunk_size = 8
+
+    def __init__(self, path, simulation_name = None, simulation_path = None, memory_budget = None,
+                 backend = "auto"):
+        self.simulation_name = simulation_name
+        self.simulation_path = simulation_path
+        self.memory_budget = memory_budget
+        self.backend = backend
+        hdf_path = None if simulation_name is None else os.path.join(simulation_path, simulation_name, 'outp-hdf')
+        snapshot_table.__init__(self, path, hdf_path)
+
+    def _reader(self):
+        return functools.partial(_snapshot_summaries, self.simulation_name, self.simulation_path,
+                                 self.memory_budget, self.backend)
+
+    def series(self):
+        return self.readable()
@@ -1,8 +1,53 @@
 import os
+import re
 import f90nml
 
+#Namelist groups read by the catalog, files containing none of them are never parsed
+RELEVANT_GROUPS = ('SHENEOSPARS', 'HEGERPARS', 'PHYSSYST', 'GRAVPARS', 'AXIVECPOTPARS',
+                   'IINDICES', 'GRIDPARS')
+_GROUP_PATTERN = re.compile(rb'^\s*[&$]\s*(\w+)', re.MULTILINE)
+#(path, mtime, size) -> [group names in the file, parsed namelist or None]
+_namelist_cache = {}
+
+def read_namelist(path, groups = RELEVANT_GROUPS):
+    """
+    Reads a parfile, returning None if it does not contain any of the
+    given groups. A fast pre-scan of the group names avoids parsing the
+    irrelevant files, and parsed namelists are cached by (path, mtime,
+    size), so every parfile is parsed at most once per build.
+    """
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size)
+    if key not in _namelist_cache:
+        with open(path, 'rb') as parfile:
+            content = parfile.read()
+        names = {name.decode().upper() for name in _GROUP_PATTERN.findall(content)}
+        namelist = None
+        if names.intersection(RELEVANT_GROUPS):
+            namelist = f90nml.reads(content.decode())
+        _namelist_cache[key] = [names, namelist]
+    names, namelist = _namelist_cache[key]
+    if not names.intersection(group.upper() for group in groups):
+        return None
+    if namelist is None:
+        namelist = f90nml.read(path)
+        _namelist_cache[key][1] = namelist
+    return namelist
+
+def clear_namelist_cache():
+    _namelist_cache.clear()
+
 def get_indices_from_parfile(file_name, path_folder):
-    namelist = f90nml.read(os.path.join(path_folder, file_name))
+    path = os.path.join(path_folder, file_name)
+    try:
+        namelist = read_namelist(path, ('IINDICES', 'GRIDPARS'))
+    except OSError:
+        raise
+    except Exception as e:
+        #f90nml reports malformed parfiles with assorted exceptions that do not name the file
+        raise ValueError("Unable to parse the parfile: " + path) from e
+    if namelist is None or 'IINDICES' not in namelist or 'GRIDPARS' not in namelist:
+        raise ValueError("Missing IINDICES or GRIDPARS group in the parfile: " + path)
     indices = {'hydro':{}, 'thd':{}}    
     if 'I_VELZ'in namelist["IINDICES"]:
         indices['thd']['I_VELZ'] = namelist["IINDICES"]["I_VELZ"] - 1   
@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import time
+import contextlib
+
+#Stage record of the simulation being profiled in this process, None when profiling is off
+_active = None
+_counters = {"file_opens": 0, "listings": 0}
+_hook_installed = False
+_io_file = None
+
+
+def _audit(event, args):
+    if _active is None:
+        return
+    if event == 'open':
+        _counters["file_opens"] += 1
+    elif event in ('os.scandir', 'os.listdir'):
+        _counters["listings"] += 1
+
+def _bytes_read():
+    """
+    Bytes read by this process so far (rchar of /proc/self/io, Linux only).
+    The file is kept open per process and read with pread, which does not
+    count as a file opening.
+    """
+    global _io_file
+    try:
+        if _io_file is None or _io_file[0] != os.getpid():
+            _io_file = (os.getpid(), os.open('/proc/self/io', os.O_RDONLY))
+        for line in os.pread(_io_file[1], 4096, 0).decode().splitlines():
+            if line.startswith('rchar:'):
+                return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def count_open():
+    """
+    Counts a file opening not seen by the audit hook, e.g. an HDF5 file
+    opened by the HDF5 library.
+    """
+    if _active is not None:
+        _counters["file_opens"] += 1
+
+def _empty_stats():
+    return {"seconds": 0., "bytes_read": 0, "file_opens": 0, "listings": 0, "calls": 0}
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Records wall time, bytes read, file openings and directory listings of
+    a block of code under the given stage of the simulation being profiled.
+    Nested stages are inclusive. It does nothing when profiling is off.
+    """
+    record = _active
+    if record is None:
+        yield
+        return
+    counters = dict(_counters)
+    bytes_read = _bytes_read()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = record.setdefault(name, _empty_stats())
+        stats["seconds"] += time.perf_counter() - start
+        stats["bytes_read"] += _bytes_read() - bytes_read
+        stats["file_opens"] += _counters["file_opens"] - counters["file_opens"]
+        stats["listings"] += _counters["listings"] - counters["listings"]
+        stats["calls"] += 1
+
+def iterate(iterable, name):
+    """
+    Iterates over iterable, recording the time spent producing the items
+    (e.g. by a generator walking the filesystem) under the given stage.
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+@contextlib.contextmanager
+def profile(record):
+    """
+    Makes record (a dictionary of stages) the target of the stages run in
+    the block, recording the whole block under the 'total' stage.
+    """
+    global _active, _hook_installed
+    if not _hook_installed:
+        sys.addaudithook(_audit)
+        _hook_installed = True
+    previous, _active = _active, record
+    try:
+        with stage('total'):
+            yield record
+    finally:
+        _active = previous
+
+class profiler:
+    """
+    Collects the stage records of the build and of every simulation, also
+    when they are produced by worker processes.
+    """
+    def __init__(self):
+        self.records = {}
+
+    def record(self, key):
+        return self.records.setdefault(key, {})
+
+    def add(self, key, record):
+        target = self.record(key)
+        for name, stats in record.items():
+            total = target.setdefault(name, _empty_stats())
+            for field, value in stats.items():
+                total[field] += value
+
+    def stages(self):
+        """
+        Stages summed over all simulations, the most expensive first.
+        """
+        totals = {}
+        for key, record in self.records.items():
+            for name, stats in record.items():
+                if name == 'total':
+                    continue
+                total = totals.setdefault(name, _empty_stats())
+                for field, value in stats.items():
+                    total[field] += value
+        return dict(sorted(totals.items(), key = lambda item: -item[1]["seconds"]))
+
+    def slowest(self, n_simulations = 10):
+        simulations = [(key, record) for key, record in self.records.items() \
+                       if key != 'build' and 'total' in record]
+        simulations.sort(key = lambda item: -item[1]['total']["seconds"])
+        return [{"simulation": key, "seconds": record['total']["seconds"],
+                 "bytes_read": record['total']["bytes_read"],
+                 "file_opens": record['total']["file_opens"]} for key, record in simulations[:n_simulations]]
+
+    def report(self):
+        return {"simulations": self.records, "stages": self.stages(),
+                "slowest_simulations": self.slowest()}
+
+    def save(self, path):
+        with open(path, 'w') as outfile:
+            json.dump(self.report(), outfile, indent=4)
+
+    def print_summary(self, n_simulations = 5):
+        print("Slowest simulations:")
+        for simulation in self.slowest(n_simulations):
+            print("\t%9.3f s  %9.2f MB  %6d opens  %s" % (simulation["seconds"], simulation["bytes_read"] / 1024 ** 2,
+                                                        simulation["file_opens"], simulation["simulation"]))
+        print("Most expensive stages (inclusive):")
+        for name, stats in list(self.stages().items())[:n_simulations * 2]:
+            print("\t%9.3f s  %9.2f MB  %6d opens  %s" % (stats["seconds"], stats["bytes_read"] / 1024 ** 2,
+                                                        stats["file_opens"], name))
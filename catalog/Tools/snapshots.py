@@ -0,0 +1,156 @@
+import os
+import abc
+import hashlib
+import functools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+def index_file(index_dir, hdf_path):
+    """
+    Path of the index of an outp-hdf folder inside index_dir.
+    """
+    return os.path.join(index_dir, hashlib.sha1(os.path.abspath(hdf_path).encode()).hexdigest() + '.npy')
+
+def _snapshot_times(hdf_path, file_names):
+    """
+    Reads only the Parameters/t dataset of each file, NaN for the files that
+    cannot be read (e.g. still being written).
+    """
+    import h5py
+    times = []
+    for file_name in file_names:
+        try:
+            with h5py.File(os.path.join(hdf_path, file_name), 'r') as data_h5:
+                times.append((float(data_h5['Parameters']['t'][0]),))
+        except Exception:
+            times.append((np.nan,))
+    return times
+
+class snapshot_table(abc.ABC):
+    """
+    Values read from every stride-th hdf output file of a simulation, stored
+    as a structured .npy sidecar (file name, the values in fields, starting
+    with the time, modification time and size) sorted by time, unreadable
+    files last. Only the files that are new or changed since the last update
+    are read, by the function returned by _reader, in chunks of chunk_size
+    files. Subclasses MUST implement _reader.
+    """
+    fields = [("time", 'f8')]
+    chunk_size = 64
+
+    def __init__(self, path, hdf_path = None):
+        self.path = path
+        self.hdf_path = hdf_path
+        self.snapshots = self.__load()
+
+    def __len__(self):
+        return self.snapshots.size
+
+    @abc.abstractmethod
+    def _reader(self):
+        """
+        Picklable function returning, for a list of file names, one tuple of
+        values per file.
+        """
+
+    def update(self, workers = 1, stride = 1):
+        """
+        Reads the new or changed files, in a pool of workers processes if
+        workers > 1, and saves the table. Returns the number of files read.
+        """
+        assert self.hdf_path is not None, "The outp-hdf folder of the table MUST be given to update it"
+        assert type(stride) == int and stride > 0, "The stride MUST be a positive integer"
+        names = [field for field, _ in self.fields]
+        known = {snapshot["file"].decode(): snapshot for snapshot in self.snapshots \
+                 if not np.isnan(snapshot["time"])}
+        with os.scandir(self.hdf_path) as entries:
+            #remove x00 files
+            entries = sorted((entry for entry in entries if entry.name.startswith('h')),
+                             key = lambda entry: entry.name)
+        rows, to_read = [], []
+        for entry in entries[::stride]:
+            stat = entry.stat()
+            snapshot = known.get(entry.name)
+            if snapshot is not None and snapshot["mtime"] == stat.st_mtime_ns and \
+                snapshot["size"] == stat.st_size:
+                rows.append((entry.name, tuple(snapshot[name] for name in names), stat.st_mtime_ns, stat.st_size))
+            else:
+                to_read.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        files = [name for name, _, _ in to_read]
+        reader = self._reader()
+        if workers > 1 and len(files) > self.chunk_size:
+            chunks = [files[start:start + self.chunk_size] for start in range(0, len(files), self.chunk_size)]
+            with ProcessPoolExecutor(max_workers = workers) as pool:
+                values = [value for chunk in pool.map(reader, chunks) for value in chunk]
+        else:
+            values = reader(files)
+        rows.extend((name, value, mtime, size) for (name, mtime, size), value in zip(to_read, values))
+        width = max([len(name) for name, _, _, _ in rows] + [1])
+        snapshots = np.array([(name.encode(),) + tuple(value) + (mtime, size) for name, value, mtime, size in rows],
+                             dtype = self.__dtype(width))
+        self.snapshots = snapshots[np.lexsort((snapshots["file"], snapshots["time"]))]
+        self.save()
+        return len(to_read)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_file = self.path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_file, 'wb') as outfile:
+            np.save(outfile, self.snapshots)
+        os.replace(tmp_file, self.path)
+
+    def readable(self):
+        """
+        Rows of the files that could be read, sorted by time.
+        """
+        return self.snapshots[:int(np.count_nonzero(~np.isnan(self.snapshots["time"])))]
+
+    def __dtype(self, width):
+        return [("file", 'S' + str(width))] + self.fields + [("mtime", 'i8'), ("size", 'i8')]
+
+    def __load(self):
+        if os.path.exists(self.path):
+            try:
+                return np.load(self.path, mmap_mode='r')
+            except (OSError, ValueError):
+                pass
+        return np.zeros(0, dtype = self.__dtype(1))
+
+class snapshot_index(snapshot_table):
+    """
+    Time of every hdf output file of a simulation, stored as a structured
+    .npy sidecar (file name, Parameters/t, modification time and size)
+    sorted by time, unreadable files last. Only the files that are new or
+    changed since the last update are read, and nearest/window lookups are
+    binary searches on the memory-mapped index.
+    """
+    def _reader(self):
+        return functools.partial(_snapshot_times, self.hdf_path)
+
+    def nearest(self, time):
+        """
+        Returns (file, time) of the snapshot closest to time, or None if no
+        snapshot could be read.
+        """
+        times = self.__times()
+        if times.size == 0:
+            return None
+        index = int(np.searchsorted(times, time))
+        if index == times.size or (index > 0 and time - times[index - 1] <= times[index] - time):
+            index -= 1
+        return self.__snapshot(index)
+
+    def window(self, start, end):
+        """
+        Returns the (file, time) pairs of the snapshots with start <= time <= end.
+        """
+        times = self.__times()
+        return [self.__snapshot(index) for index in range(int(np.searchsorted(times, start, 'left')),
+                                                          int(np.searchsorted(times, end, 'right')))]
+
+    def __times(self):
+        return self.readable()["time"]
+
+    def __snapshot(self, index):
+        return self.snapshots["file"][index].decode(), float(self.snapshots["time"][index])
@@ -1,4 +1,8 @@
 from catalog import catalog
+from storage import open_storage, merge_catalogs
+import os
+import sys
+import json
 import argparse
 parser = argparse.ArgumentParser()
 parser.add_argument('--catalog-name', type=str, required=True,
@@ -11,22 +15,222 @@ parser.add_argument('--save-folder', type=str, default='.',
                     help="Path in which to save the catalog.")
 parser.add_argument('--remove-simulation', action='store_true', default=False)
 parser.add_argument('--add-entry', action='store_true', default=False)
+parser.add_argument('--add-entries-from', type=str, default=None,
+                    help="Text file listing the simulations to add, one per line, either as the full " + \
+                        "path of the simulation or as its name and path separated by a tab.")
 parser.add_argument('--simulation-name', type=str, default=None,
                     help="Name of the simulation to remove or add")
 parser.add_argument('--simulation-path', type=str, default=None,
                     help="Path of the simulation to remove or add.")
-args = parser.parse_args()
-
-cat = catalog(save_name = args.catalog_name,
-              path_list = args.paths_to_include,
-              path_to_previous_catalog = args.path_to_previous_catalog,
-              save_folder = args.save_folder)
-
-if args.remove_simulation:
-    cat.remove_entry(simulation_name = args.simulation_name,
-                     simulation_path = args.simulation_path)
-if args.add_entry:
-    cat.add_entry(simulation_name = args.simulation_name,
-                  simulation_path = args.simulation_path)
+parser.add_argument('--workers', type=int, default=1,
+                    help="Number of processes used to extract the simulations' parameters.")
+parser.add_argument('--discovery-threads', type=int, default=1,
+                    help="Maximum number of folders listed at the same time while looking for " + \
+                        "simulations. Values above 1 help on network filesystems (NFS, Lustre).")
+parser.add_argument('--backend', type=str, default='auto', choices=['auto', 'scidata', 'tools'],
+                    help="Analysis backend used to read the simulations: scidata, the bundled Tools, " + \
+                        "or scidata when installed and the bundled Tools otherwise (auto). It is " + \
+                        "only imported when simulations are actually read.")
+parser.add_argument('--memory-budget', type=float, default=None,
+                    help="Maximum amount of HDF5 data (in MB) read at once when averaging over the angles.")
+parser.add_argument('--grid-cache', type=str, default=None,
+                    help="Folder in which to cache the parsed grids as binary files.")
+parser.add_argument('--time-index', type=str, default=None,
+                    help="Folder in which to write, for each simulation, an index of the time of its " + \
+                        "snapshots, updated incrementally and referenced by the time_index field.")
+parser.add_argument('--time-index-workers', type=int, default=1,
+                    help="Number of processes reading the snapshot times of a simulation.")
+parser.add_argument('--evolution', type=str, default=None,
+                    help="Folder in which to write, for each simulation, the time evolution of the maxima " + \
+                        "of the angle averaged omega and magnetic fields over its snapshots, updated " + \
+                        "incrementally and referenced by the evolution field.")
+parser.add_argument('--evolution-stride', type=int, default=1,
+                    help="Read only one snapshot every evolution-stride for the time evolution.")
+parser.add_argument('--evolution-workers', type=int, default=1,
+                    help="Number of processes reading the snapshots of a simulation for the time evolution.")
+parser.add_argument('--cache-dir', type=str, default=None,
+                    help="Folder of an extraction cache shared by all the catalogs: simulations already " + \
+                        "extracted by another catalog are taken from it if their files did not change.")
+parser.add_argument('--cache-size', type=float, default=512,
+                    help="Maximum size (in MB) of the extraction cache, beyond which the least recently " + \
+                        "used entries are evicted.")
+parser.add_argument('--fast', action='store_true', default=False,
+                    help="Extract only what the parfiles, the grid, the density log and the file dates " + \
+                        "give, without opening any HDF5 file. The total time is estimated from the " + \
+                        "density log, and the omega and B fields not given in the parfiles are listed " + \
+                        "as deferred, to be filled later with --fill-deferred.")
+parser.add_argument('--fill-deferred', action='store_true', default=False,
+                    help="Instead of building the catalog, read the fields deferred and the total " + \
+                        "time estimated by a fast build for the entries of the previous catalog.")
+parser.add_argument('--storage', type=str, default='sqlite', choices=['sqlite', 'json', 'columnar'],
+                    help="Format in which the catalog is saved.")
+parser.add_argument('--export-json', type=str, default=None,
+                    help="Path of a pretty-printed JSON copy of the catalog to write at the end.")
+parser.add_argument('--export-columnar', type=str, default=None,
+                    help="Path of a folder in which to write a memory-mappable columnar copy of the " + \
+                        "catalog (one .npy file per field) at the end.")
+parser.add_argument('--profile-report', type=str, default=None,
+                    help="Path of a JSON file in which to write the time, bytes read and files " + \
+                        "opened by each stage of the build and of each simulation.")
+parser.add_argument('--shard', type=str, default=None,
+                    help="Build only the shard i of N (i/N, 0 <= i < N) of the simulations found, so " + \
+                        "that N independent jobs can each write a partial catalog, then combined " + \
+                        "with the merge command. All the jobs MUST be given the same paths.")
+parser.add_argument('--checkpoint-interval', type=float, default=60.,
+                    help="Seconds between two checkpoints of the build, from which an interrupted build " + \
+                        "can be resumed with --resume. A negative value disables checkpointing.")
+parser.add_argument('--resume', action='store_true', default=False,
+                    help="Continue an interrupted build from its last checkpoint, without extracting " + \
+                        "again the simulations already completed. The build MUST be given the same " + \
+                        "arguments as the interrupted one.")
+parser.add_argument('--discover-only', action='store_true', default=False,
+                    help="Only list the simulations a build would find, with the cost of their " + \
+                        "extraction estimated without opening any HDF5 file.")
+parser.add_argument('--watch', action='store_true', default=False,
+                    help="Keep running, adding new simulations and refreshing the ones that get new " + \
+                        "snapshots, instead of building the catalog once.")
+parser.add_argument('--watch-mode', type=str, default='auto', choices=['auto', 'inotify', 'poll'],
+                    help="How changes are detected in watch mode. inotify only sees changes made on " + \
+                        "this machine: use poll on network filesystems written by other nodes.")
+parser.add_argument('--watch-interval', type=float, default=10.,
+                    help="Polling interval (in seconds) of the folders that changed recently.")
+parser.add_argument('--save-delay', type=float, default=30.,
+                    help="In watch mode, seconds without changes after which the catalog is saved.")
+parser.add_argument('--refresh', action='store_true', default=False,
+                    help="Extract again the simulations already in the catalog whose files changed.")
+
+query_parser = argparse.ArgumentParser(prog='build_catalog.py query',
+                                       description="Select the simulations of a catalog.")
+query_parser.add_argument('catalog_path', type=str,
+                          help="Path of the catalog to query.")
+query_parser.add_argument('--where', nargs='+', default=[],
+                          help="Conditions on the catalog fields, e.g. dimensions=3 NS_EOS=SFHo " + \
+                              "'omega>0.5' Heger_model~s15. Operators: =, !=, <, <=, >, >=, ~ (substring).")
+query_parser.add_argument('--fields', nargs='+', default=['name', 'location'],
+                          help="Fields to print for each selected simulation.")
+query_parser.add_argument('--json', action='store_true', default=False,
+                          help="Print the full selected entries as JSON.")
+
+merge_parser = argparse.ArgumentParser(prog='build_catalog.py merge',
+                                       description="Merge partial catalogs into a single catalog.")
+merge_parser.add_argument('output_path', type=str,
+                          help="Path of the merged catalog.")
+merge_parser.add_argument('catalog_paths', nargs='+',
+                          help="Paths of the catalogs to merge.")
+merge_parser.add_argument('--storage', type=str, default=None, choices=['sqlite', 'json', 'columnar'],
+                          help="Format of the merged catalog, by default guessed from its extension.")
+
+cache_parser = argparse.ArgumentParser(prog='build_catalog.py cache',
+                                       description="Inspect or prune the shared extraction cache.")
+cache_parser.add_argument('action', choices=['stats', 'prune'])
+cache_parser.add_argument('--cache-dir', type=str, required=True,
+                          help="Folder of the extraction cache.")
+cache_parser.add_argument('--max-size', type=float, default=512,
+                          help="Size (in MB) to which the cache is pruned, evicting the least recently " + \
+                              "used entries.")
+cache_parser.add_argument('--keep-missing', action='store_true', default=False,
+                          help="Do not remove the entries of the simulations that no longer exist.")
+
+def manage_cache(args):
+    from cache import extraction_cache
+    cache = extraction_cache(args.cache_dir, int(args.max_size * 1024 ** 2))
+    if args.action == 'prune':
+        print("Removed entries:", cache.prune(missing = not args.keep_missing))
+    stats = cache.stats()
+    print("Cache:", stats["path"])
+    print("Entries:", stats["entries"])
+    print("Size: %.2f MB of %.2f MB" % (stats["size"] / 1024 ** 2, stats["max_size"] / 1024 ** 2))
+    print("Hits:", stats["hits"], "misses:", stats["misses"])
+
+def parse_shard(shard):
+    if shard is None:
+        return None
+    index, count = shard.split('/')
+    return int(index), int(count)
+
+def read_manifest(path):
+    """
+    Reads the (name, path) pairs of a list of simulations, skipping empty
+    lines and comments (#).
+    """
+    simulations = []
+    with open(path) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if '\t' in line:
+                name, location = line.split('\t', 1)
+                simulations.append((name.strip(), location.strip()))
+            else:
+                line = line.rstrip('/')
+                simulations.append((os.path.basename(line), os.path.dirname(line)))
+    return simulations
+
+def query_catalog(args):
+    from query import catalog_index
+    entries = catalog_index(open_storage(args.catalog_path).load()).query(args.where)
+    if args.json:
+        print(json.dumps(entries, indent=4))
+        return
+    for entry in entries:
+        print('\t'.join(str(entry.get(field, '')) for field in args.fields))
+    print("Selected simulations:", len(entries))
+
+if __name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1] == 'query':
+    query_catalog(query_parser.parse_args(sys.argv[2:]))
+elif __name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1] == 'merge':
+    args = merge_parser.parse_args(sys.argv[2:])
+    print("Merged catalog size:", merge_catalogs(args.catalog_paths, args.output_path, args.storage))
+elif __name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1] == 'cache':
+    manage_cache(cache_parser.parse_args(sys.argv[2:]))
+elif __name__ == '__main__':
+    args = parser.parse_args()
+
+    cat = catalog(save_name = args.catalog_name,
+                  path_list = args.paths_to_include,
+                  path_to_previous_catalog = args.path_to_previous_catalog,
+                  save_folder = args.save_folder,
+                  workers = args.workers,
+                  refresh = args.refresh,
+                  memory_budget = None if args.memory_budget is None else \
+                      int(args.memory_budget * 1024 ** 2),
+                  grid_cache = args.grid_cache,
+                  storage_format = args.storage,
+                  profile_report = args.profile_report,
+                  discovery_threads = args.discovery_threads,
+                  shard = parse_shard(args.shard),
+                  backend = args.backend,
+                  time_index = args.time_index,
+                  time_index_workers = args.time_index_workers,
+                  cache = args.cache_dir,
+                  cache_size = int(args.cache_size * 1024 ** 2),
+                  fast = args.fast,
+                  checkpoint_interval = None if args.checkpoint_interval < 0 else args.checkpoint_interval,
+                  resume = args.resume,
+                  evolution = args.evolution,
+                  evolution_stride = args.evolution_stride,
+                  evolution_workers = args.evolution_workers,
+                  discover_only = args.discover_only)
+
+    if args.remove_simulation:
+        cat.remove_entry(simulation_name = args.simulation_name,
+                         simulation_path = args.simulation_path)
+    if args.add_entry:
+        cat.add_entry(simulation_name = args.simulation_name,
+                      simulation_path = args.simulation_path)
+    if args.add_entries_from is not None:
+        cat.add_entries(read_manifest(args.add_entries_from))
     
-cat.build_catalog()
\ No newline at end of file
+    if args.discover_only:
+        cat.discover()
+    elif args.fill_deferred:
+        cat.fill_deferred()
+    elif args.watch:
+        cat.watch(mode = args.watch_mode, interval = args.watch_interval, save_delay = args.save_delay)
+    else:
+        cat.build_catalog()
+    if args.export_json is not None:
+        cat.export_json(args.export_json)
+    if args.export_columnar is not None:
+        cat.export_columnar(args.export_columnar)
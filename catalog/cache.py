@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import sqlite3
+
+CACHE_FILE = 'extraction_cache.sqlite'
+
+
+class extraction_cache:
+    """
+    Extracted parameters of simulations shared by all the catalogs, stored
+    in an SQLite database inside cache_dir. Entries are keyed by the real
+    path of the simulation and hold the fingerprint of its inputs, so a
+    cached entry is only reused as is when the simulation did not change.
+    The cache is kept under max_size bytes by evicting the least recently
+    used entries.
+    """
+    def __init__(self, cache_dir, max_size = 512 * 1024 ** 2):
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, CACHE_FILE)
+        self.max_size = max_size
+
+    @staticmethod
+    def key(folder, simulation_path):
+        return os.path.realpath(os.path.join(simulation_path, folder))
+
+    def get(self, key):
+        """
+        Returns the cached entry of a simulation, or None.
+        """
+        connection = self.__connect()
+        try:
+            with connection:
+                row = connection.execute("SELECT data FROM entries WHERE path = ?", (key,)).fetchone()
+                if row is None:
+                    self.__count(connection, "misses")
+                    return None
+                connection.execute("UPDATE entries SET last_used = ? WHERE path = ?", (time.time(), key))
+                self.__count(connection, "hits")
+                return json.loads(row[0])
+        finally:
+            connection.close()
+
+    def put(self, key, entry):
+        """
+        Stores the entry of a simulation, then evicts the least recently used
+        entries while the cache exceeds its maximum size.
+        """
+        data = json.dumps(entry)
+        connection = self.__connect()
+        try:
+            with connection:
+                connection.execute("INSERT INTO entries (path, data, size, last_used) VALUES (?, ?, ?, ?) " + \
+                                   "ON CONFLICT (path) DO UPDATE SET data = excluded.data, " + \
+                                   "size = excluded.size, last_used = excluded.last_used",
+                                   (key, data, len(data), time.time()))
+                self.__evict(connection, self.max_size)
+        finally:
+            connection.close()
+
+    def stats(self):
+        connection = self.__connect()
+        try:
+            entries, size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            counters = dict(connection.execute("SELECT name, value FROM counters"))
+        finally:
+            connection.close()
+        return {"path": self.path, "entries": entries, "size": size, "max_size": self.max_size,
+                "hits": counters.get("hits", 0), "misses": counters.get("misses", 0)}
+
+    def prune(self, max_size = None, missing = True):
+        """
+        Removes the entries of the simulations that no longer exist (if
+        missing) and evicts the least recently used entries down to max_size
+        bytes (the maximum size of the cache by default). Returns the number
+        of entries removed.
+        """
+        connection = self.__connect()
+        try:
+            with connection:
+                before = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                if missing:
+                    gone = [(path,) for (path,) in connection.execute("SELECT path FROM entries") \
+                            if not os.path.isdir(path)]
+                    connection.executemany("DELETE FROM entries WHERE path = ?", gone)
+                self.__evict(connection, self.max_size if max_size is None else max_size)
+                removed = before - connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            connection.execute("VACUUM")
+        finally:
+            connection.close()
+        return removed
+
+    def __evict(self, connection, max_size):
+        size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if size <= max_size:
+            return
+        evicted = []
+        for path, entry_size in connection.execute("SELECT path, size FROM entries ORDER BY last_used"):
+            if size <= max_size:
+                break
+            evicted.append((path,))
+            size -= entry_size
+        connection.executemany("DELETE FROM entries WHERE path = ?", evicted)
+
+    def __count(self, connection, name):
+        connection.execute("INSERT INTO counters (name, value) VALUES (?, 1) " + \
+                           "ON CONFLICT (name) DO UPDATE SET value = value + 1", (name,))
+
+    def __connect(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        #several builds and workers may share the cache at the same time
+        connection = sqlite3.connect(self.path, timeout = 60)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, data TEXT NOT NULL, " + \
+                           "size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        return connection
@@ -1,43 +1,255 @@
 import os
-import json
-import f90nml
-try:
-    from scidata.quantities.quantities import SimulationAnalysis
-except:
-    from Tools.Tools import SimulationAnalysis
-import pathlib
-import datetime
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from extraction import read_simulations_parameters, extract_simulation, profiled_extraction, \
+    analysis_backend, pending_stages, BACKENDS
+from discovery import find_simulations, shard_of, estimate_cost
+from fingerprint import simulation_fingerprint, changed_stages
+from store import catalog_store
+from checkpoint import build_checkpoint
+from watch import tree_watcher
+from storage import STORAGES, open_storage, json_storage, columnar_storage
+from Tools.parameters import clear_namelist_cache
+from Tools import profiling
 
 
 class catalog:
-    def __init__(self, save_name, path_list, path_to_previous_catalog = None, save_folder = '..'):
+    def __init__(self, save_name, path_list, path_to_previous_catalog = None, save_folder = '..',
+                 workers = 1, refresh = False, memory_budget = None, grid_cache = None,
+                 storage_format = 'sqlite', profile_report = None, discovery_threads = 1,
+                 shard = None, backend = 'auto', time_index = None, time_index_workers = 1,
+                 cache = None, cache_size = 512 * 1024 ** 2, fast = False, checkpoint_interval = 60.,
+                 resume = False, evolution = None, evolution_stride = 1, evolution_workers = 1,
+                 discover_only = False):
+        assert type(workers) == int and workers > 0, "The number of workers MUST be a positive integer"
+        assert type(discovery_threads) == int and discovery_threads > 0, \
+            "The number of discovery threads MUST be a positive integer"
+        assert backend in BACKENDS, "The analysis backend MUST be one of " + str(BACKENDS)
+        assert shard is None or (len(shard) == 2 and 0 <= shard[0] < shard[1]), \
+            "The shard MUST be a (index, count) pair with 0 <= index < count"
         self.__catalog = self.__read_catalog(path_to_previous_catalog)
-        self.__save_path, self.__save_README = self.__check_save_path(save_name, save_folder)
+        assert storage_format in STORAGES, "Storage format MUST be one of " + str(list(STORAGES))
+        #A dry run writes nothing, so it never asks to overwrite an existing catalog
+        self.__discover_only = discover_only
+        if discover_only:
+            self.__save_path, self.__save_README = None, None
+            self.__storage = None
+        else:
+            self.__save_path, self.__save_README = self.__check_save_path(save_name, save_folder,
+                                                                          STORAGES[storage_format].extension)
+            self.__storage = open_storage(self.__save_path, storage_format)
+        #The storage already holds the loaded catalog only if it is the catalog being updated
+        self.__index = None
+        self.__synced = path_to_previous_catalog is not None and self.__save_path is not None and \
+            os.path.exists(self.__save_path) and \
+            os.path.realpath(path_to_previous_catalog) == os.path.realpath(self.__save_path)
         self.__path_list = path_list
+        self.__workers = workers
+        self.__discovery_threads = discovery_threads
+        self.__shard = shard
+        self.__refresh = refresh
+        self.__options = {"memory_budget": memory_budget, "grid_cache": grid_cache, "backend": backend,
+                          "time_index": time_index, "time_index_workers": time_index_workers,
+                          "cache": cache, "cache_size": cache_size, "fast": fast, "evolution": evolution,
+                          "evolution_stride": evolution_stride, "evolution_workers": evolution_workers}
+        assert type(evolution_stride) == int and evolution_stride > 0, "The evolution stride MUST be a positive integer"
+        assert checkpoint_interval is None or checkpoint_interval >= 0, \
+            "The checkpoint interval MUST be a non-negative number of seconds"
+        assert not resume or checkpoint_interval is not None, "A build MUST be checkpointed to be resumed"
+        self.__checkpoint_interval = checkpoint_interval
+        self.__resume = resume
+        self.__checkpoint = None
+        self.__profile_report = profile_report
+        self.__profiler = None if profile_report is None else profiling.profiler()
     
     def build_catalog(self):
         if self.__path_list is None:
             return
-        assert type(self.__path_list) == str or type(self.__path_list) == list, "Wrong path list format."
+        paths = self.__paths()
         print("Initial catalog size:", len(self.__catalog))
-        if (len(self.__path_list) == 1 and type(self.__path_list[0]) == str):
-            self.__check_folder_for_simulations(self.__path_list[0])
-        elif type(self.__path_list[0]) == str:
-            for path in self.__path_list:
-                self.__check_folder_for_simulations(path)
-        else:
-            raise ValueError("path format not recognized")
+        self.__refreshed = 0
+        #fails here, not in every extraction, if the backend cannot be imported
+        analysis_backend(self.__options["backend"])
+        if self.__profiler is None:
+            self.__scan(paths)
+            return
+        with profiling.profile(self.__profiler.record('build')):
+            self.__scan(paths)
+        self.__profiler.save(self.__profile_report)
+        self.__profiler.print_summary()
+
+    def __scan(self, paths):
+        simulations = self.__open_checkpoint(paths, self.__discovered(paths))
+        try:
+            self.__extract_simulations(self.__new_simulations(profiling.iterate(simulations, 'discovery')))
+        finally:
+            if self.__checkpoint is not None:
+                self.__checkpoint.close()
+        clear_namelist_cache()
         print("Final catalog size:", len(self.__catalog))
+        if self.__refresh:
+            print("Refreshed entries:", self.__refreshed)
+        with profiling.stage('save'):
+            self.__save_catalog()
+        self.__remove_checkpoint()
+
+    def __open_checkpoint(self, paths, simulations, watch = False):
+        """
+        Opens the checkpoint of the build, if checkpointed, returning the
+        discovered simulations going through it.
+        """
+        if self.__checkpoint_interval is None:
+            return simulations
+        self.__checkpoint = build_checkpoint(self.__save_path + '.checkpoint', self.__settings(paths, watch),
+                                             self.__checkpoint_interval, self.__resume)
+        if len(self.__checkpoint) > 0:
+            print("Resuming from checkpoint, completed simulations:", len(self.__checkpoint))
+        return self.__checkpoint.discovered(simulations)
+
+    def __remove_checkpoint(self):
+        if self.__checkpoint is not None:
+            self.__checkpoint.remove()
+            self.__checkpoint = None
+
+    def discover(self):
+        """
+        Dry run of build_catalog: lists the simulations found, with the cost
+        of their extraction estimated from metadata only (no HDF5 file is
+        opened), and whether a build would extract them. Returns the list of
+        the estimates.
+        """
+        if self.__path_list is None:
+            return []
+        estimates = []
+        for folder, path in self.__discovered(self.__paths(), verbose = False):
+            estimate = estimate_cost(folder, path, self.__catalog.get(folder, path))
+            estimate["status"] = self.__status(folder, path)
+            estimates.append(estimate)
+        print("%10s %4s %9s %10s  %-10s %s" % ("cost (MB)", "dim", "snapshots", "outp (GB)", "status",
+                                                 "simulation"))
+        for estimate in estimates:
+            print("%10.2f %4d %9d %10.3f  %-10s %s" % (estimate["cost"] / 1024 ** 2, estimate["dimensions"],
+                                                       estimate["snapshots"], estimate["hdf_bytes"] / 1024 ** 3,
+                                                       estimate["status"],
+                                                       os.path.join(estimate["location"], estimate["name"])))
+        extracted = [estimate for estimate in estimates if estimate["status"] in ('new', 'changed')]
+        print("Simulations found:", len(estimates), "to extract:", len(extracted))
+        print("Estimated data read: %.2f MB" % (sum(estimate["cost"] for estimate in extracted) / 1024 ** 2))
+        return estimates
+
+    def fill_deferred(self):
+        """
+        Extracts the fields deferred by a fast build, and the total time it
+        estimated from the density log, for the entries of the catalog having
+        any, without walking the paths again. Only the parameters depending
+        on the HDF5 outputs are read.
+        """
+        assert not self.__options["fast"], "The deferred fields MUST be filled outside the fast mode"
+        deferred = [(entry["name"], entry["location"], entry) for entry in self.__catalog \
+                    if entry.get("deferred") or entry.get("total_time_estimated")]
+        print("Entries with deferred fields:", len(deferred))
+        self.__refreshed = 0
+        analysis_backend(self.__options["backend"])
+        self.__extract_simulations(deferred)
+        clear_namelist_cache()
+        print("Filled entries:", self.__refreshed)
         self.__save_catalog()
 
+    def watch(self, mode = 'auto', interval = 10., save_delay = 30.):
+        """
+        Keeps the catalog up to date until interrupted (Ctrl+C). After a first
+        pass equivalent to a refresh build, run by the workers of the catalog
+        and checkpointed as a build, the simulations that appear are
+        added and the ones getting new snapshots are refreshed, recomputing
+        only the parameters whose inputs changed. Saves wait until no change
+        was seen for save_delay seconds, or at most ten times as long during
+        a continuous stream of changes.
+        """
+        if self.__path_list is None:
+            return
+        paths = self.__paths()
+        analysis_backend(self.__options["backend"])
+        tree = tree_watcher(paths, mode, interval)
+        first_change = last_change = None
+        try:
+            self.__refreshed = 0
+            simulations = self.__open_checkpoint(paths, self.__sharded(tree.start()), watch = True)
+            try:
+                self.__extract_simulations((folder, path, self.__check_existence(folder, path)) \
+                                           for folder, path in simulations)
+            finally:
+                if self.__checkpoint is not None:
+                    self.__checkpoint.close()
+            clear_namelist_cache()
+            self.__save_catalog()
+            self.__remove_checkpoint()
+            print("Watching", len(paths), "path(s), catalog size:", len(self.__catalog))
+            simulations = []
+            while True:
+                updated = sum(self.__update_simulation(folder, path) for folder, path in simulations)
+                #the parfiles of each change are parsed anew, so the cache only grows with the daemon
+                clear_namelist_cache()
+                now = time.monotonic()
+                if updated > 0:
+                    print("Updated entries:", updated)
+                    last_change = now
+                    first_change = now if first_change is None else first_change
+                if first_change is not None and (now - last_change >= save_delay or \
+                                                 now - first_change >= 10 * save_delay):
+                    self.__save_catalog()
+                    first_change = None
+                    print("Catalog saved, size:", len(self.__catalog))
+                timeout = interval if first_change is None else \
+                    max(0., min(interval, last_change + save_delay - now))
+                simulations = tree.changes(timeout)
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+        finally:
+            tree.close()
+            if first_change is not None:
+                self.__save_catalog()
+
     def add_entry(self, simulation_name, simulation_path):
         assert type(simulation_name) == str, "The name of the simulation MUST be a string"
         assert type(simulation_path) == str, "The path of the simulation MUST be a string"
         assert os.path.exists(os.path.join(simulation_path, simulation_name)), \
             "The selected simulation does not exists or you do not have the permission to access"
-        self.__catalog.append(self.__read_simulations_parameters(simulation_name, simulation_path))
+        self.__catalog.insert(read_simulations_parameters(simulation_name, simulation_path,
+                                                          options = self.__options))
         self.__save_catalog()
     
+    def add_entries(self, simulations):
+        """
+        Adds many simulations, given as (name, path) pairs, at once. All the
+        pairs are checked before extracting anything, the simulations are
+        extracted with the workers of the catalog and the catalog is saved
+        once at the end. A simulation already in the catalog is refreshed,
+        and keeps its entry if it cannot be read. Returns the list of the
+        pairs that could not be added.
+        """
+        simulations = list(simulations)
+        assert all(len(simulation) == 2 and type(simulation[0]) == str and type(simulation[1]) == str \
+                   for simulation in simulations), "The simulations MUST be (name, path) pairs of strings"
+        missing = [os.path.join(path, name) for name, path in simulations \
+                   if not os.path.exists(os.path.join(path, name))]
+        assert not missing, "The following simulations do not exist or you do not have the " + \
+            "permission to access: " + ", ".join(missing)
+        analysis_backend(self.__options["backend"])
+        self.__refreshed = 0
+        self.__extract_simulations((name, path, self.__check_existence(name, path)) \
+                                   for name, path in dict.fromkeys(simulations))
+        #a simulation already in the catalog that cannot be read keeps its outdated entry
+        failed = [(name, path) for name, path in dict.fromkeys(simulations) \
+                  if "access" in self.__catalog.get(name, path) or \
+                  changed_stages(self.__catalog.get(name, path).get("fingerprint"),
+                                 simulation_fingerprint(name, path))]
+        for name, path in failed:
+            print("Unable to read", os.path.join(path, name))
+        print("Added entries:", len(simulations) - len(failed), "failed:", len(failed))
+        self.__save_catalog()
+        return failed
+
     def remove_entry(self, simulation_name, simulation_path = None):
         assert type(simulation_name) == str, "The name of the simulation MUST be a string"
         assert type(simulation_path) == str or simulation_path is None, "The path of the simulation MUST be a string"
@@ -47,21 +259,110 @@ class catalog:
                 sure = input("You are about to delete all entries called " + simulation_name + ", are you sure? (Y/n) ")
             if sure == 'n':
                 return None
-            
-            for simulation in self.__catalog:
-                if sure == 'Y':
-                    if simulation["name"] == simulation_name:
-                        self.__catalog.remove(simulation)
-                else:
-                    if simulation["name"] == simulation_name and simulation["location"] == simulation_path:
-                        self.__catalog.remove(simulation)
-                        break
+            removed = self.__catalog.delete_name(simulation_name)
+        else:
+            removed = int(self.__catalog.delete(simulation_name, simulation_path) is not None)
+        print("Removed entries:", removed)
         self.__save_catalog()
+
+    def query(self, conditions):
+        """
+        Returns the entries satisfying all the conditions, given either as
+        strings ("dimensions=3", "omega>0.5", "Heger_model~s15") or as
+        (field, operator, value) tuples.
+        """
+        from query import catalog_index
+        if self.__index is None or self.__index[0] != self.__catalog.version:
+            self.__index = (self.__catalog.version, catalog_index(self.__catalog))
+        return self.__index[1].query(conditions)
+
+    def snapshots(self, simulation_name, simulation_path, time, end = None, after_bounce = False):
+        """
+        Looks up the snapshot time index of a simulation built with the
+        time_index option. Returns the (file, time) pair of the snapshot
+        nearest to time or, if end is given, the list of the pairs with
+        time <= t <= end. With after_bounce, times are taken from the bounce.
+        """
+        from Tools.snapshots import snapshot_index
+        entry = self.__catalog.get(simulation_name, simulation_path)
+        assert entry is not None and "time_index" in entry, \
+            "The simulation MUST be in the catalog with a time index"
+        shift = entry["bounce_time"] if after_bounce else 0
+        index = snapshot_index(entry["time_index"])
+        if end is None:
+            return index.nearest(time + shift)
+        return index.window(time + shift, end + shift)
+
+    def evolution(self, simulation_name, simulation_path, after_bounce = False):
+        """
+        Time evolution of a simulation built with the evolution option: a
+        structured array with the time and the maxima of the angle averaged
+        omega, poloidal and toroidal magnetic fields of its snapshots, sorted
+        by time. With after_bounce, times are taken from the bounce.
+        """
+        from Tools.evolution import evolution_series
+        entry = self.__catalog.get(simulation_name, simulation_path)
+        assert entry is not None and "evolution" in entry, \
+            "The simulation MUST be in the catalog with a time evolution"
+        series = evolution_series(entry["evolution"]).series().copy()
+        if after_bounce:
+            series["time"] -= entry["bounce_time"]
+        return series
+
+    def export_json(self, path):
+        """
+        Exports the catalog as a pretty-printed JSON file.
+        """
+        json_storage(path).save(self.__catalog)
+
+    def export_columnar(self, path):
+        """
+        Exports the catalog as a folder of memory-mappable .npy columns, to be
+        opened with columnar.columnar_catalog.
+        """
+        columnar_storage(path).save(self.__catalog)
         
-    def __check_save_path(self, save_name, save_folder):
+    def __paths(self):
+        assert type(self.__path_list) == str or type(self.__path_list) == list, "Wrong path list format."
+        if type(self.__path_list) == str:
+            return [self.__path_list]
+        elif all(type(path) == str for path in self.__path_list):
+            return self.__path_list
+        raise ValueError("path format not recognized")
+
+    def __discovered(self, paths, verbose = True):
+        return self.__sharded(find_simulations(paths, verbose = verbose, concurrency = self.__discovery_threads))
+
+    def __sharded(self, simulations):
+        if self.__shard is None:
+            return simulations
+        return ((folder, path) for folder, path in simulations \
+                if shard_of(folder, path, self.__shard[1]) == self.__shard[0])
+
+    def __settings(self, paths, watch = False):
+        """
+        Options of the build that a resumed build MUST share.
+        """
+        return {"paths": paths, "shard": self.__shard, "refresh": self.__refresh or watch,
+                "fast": self.__options["fast"], "watch": watch}
+
+    def __status(self, folder, path):
+        """
+        What a build would do with a simulation, without changing the catalog.
+        """
+        entry = self.__catalog.get(folder, path)
+        if entry is None or "access" in entry or entry.get("Heger_model") == "original parfile not found":
+            return 'new'
+        if not self.__refresh:
+            return 'skipped'
+        if pending_stages(entry, simulation_fingerprint(folder, path), self.__options):
+            return 'changed'
+        return 'unchanged'
+
+    def __check_save_path(self, save_name, save_folder, extension):
         while not (os.path.exists(save_folder) and os.path.isdir(save_folder)):
             save_folder = input("Please insert a valid save folder path.")
-        path_save = os.path.join(save_folder, save_name + '.json')
+        path_save = os.path.join(save_folder, save_name + extension)
         path_save_readme = os.path.join(save_folder, 'README_' + save_name + '.txt')
         if not os.path.exists(path_save):
             return path_save, path_save_readme
@@ -77,223 +378,43 @@ class catalog:
                 return path_save, path_save_readme
         if over_write == 'n' or sure == 'n':
             save_name = input("Please insert a new save_name: ")
-            return self.__check_save_path(save_name, save_folder)
+            return self.__check_save_path(save_name, save_folder, extension)
                 
             
     def __read_catalog(self, path_to_catalog):
         if path_to_catalog is not None and os.path.exists(path_to_catalog):
-            with open(path_to_catalog) as infile:
-                catalog = json.load(infile)
+            catalog = catalog_store(open_storage(path_to_catalog).load())
         else:
-            catalog = []
+            catalog = catalog_store()
         return catalog
     
 
-    def __remove_redundant_folders(self, dirs):
-        """
-        Removes the Initial models and EOS folders from a list of directories
-        """
-        while 'Initial_Models' in dirs:
-            dirs.remove('Initial_Models')
-        while 'EOS' in dirs:
-            dirs.remove('EOS')
-        return dirs
-    
-    def __polish_path(self, string, remove_bars = True, remove_points = True):
-        if remove_bars:
-            while string.find('/') != -1:
-                string = string[string.find('/')+1:]
-        if remove_points:
-            while string.find('.') != -1:
-                string = string[:string.find('.')]
-        return string
-
     def __check_existence(self, folder, path):
         """
         Run the catalog and check if the simulation is already there. In case of previous
         denied access the simulation is removed and checked again.
+        Returns the existing entry, or None.
         """
-        exists = False
-        for simulation in self.__catalog:
-            if simulation["name"] == folder and simulation["location"] == path \
-                and "access" not in simulation.keys():
-                exists = True
-                if simulation["Heger_model"] == "original parfile not found":
-                    self.__catalog.remove(simulation)
-                    exists = False
-                break
-            elif simulation["name"] == folder and simulation["location"] == path \
-                and "access"  in simulation.keys():
-                self.__catalog.remove(simulation)
-                break
-        return exists
-
-    def __sort_keywords(self, dictionary):
-        """
-        Sorts the keys of a single simulation dictionary.
-        """
-
-        if not dictionary["magnetic_fields"]:
-            keys = ["name", "location", "dimensions", "NS_EOS", "Heger_model", "gravity", "neutrinos",
-                    "gravitational_potential", "lapse_function", "total_time", "bounce_time", "inner_dr", 
-                    "nx", "ny", "nz", "omega", "magnetic_fields", "simulation_started", "simulation_ended", 
-                    "nucleosynthesis_computed"]
-        else:
-            keys = ["name", "location", "dimensions", "NS_EOS", "Heger_model", "gravity", "neutrinos",
-                "gravitational_potential", "lapse_function", "total_time", "bounce_time", "inner_dr", 
-                "nx", "ny", "nz", "omega", "magnetic_fields", "poloidal_b_field", "toroidal_b_field",
-                "simulation_started", "simulation_ended", "nucleosynthesis_computed"]
-            
-        if "comment" in dictionary.keys():
-            keys.append("comment")
-        return {key: dictionary[key] for key in keys}
-    
-    def __read_simulations_parameters(self, folder, simulation_path):
-        sim = SimulationAnalysis(folder, simulation_folder_path = simulation_path)
-        parameter_dictionary = {}
-        parameter_dictionary["name"] = folder
-        parameter_dictionary["location"] = simulation_path
-        parameter_dictionary["dimensions"] = sim.dim
-        parameter_dictionary["inner_dr"] = sim.cell.dr(sim.ghost)[0]
-        parameter_dictionary["nx"] = sim.cell.radius(sim.ghost).size
-        parameter_dictionary["ny"] = 1
-        parameter_dictionary["nz"] = 1
-        if sim.dim > 1:
-            parameter_dictionary["ny"] = sim.cell.theta(sim.ghost).size
-            if sim.dim > 2:
-                parameter_dictionary["nz"] = sim.cell.phi(sim.ghost).size
-        #Neutrino scheme: there is no flag for the neutrino scheme for now.
-        #Since most simulations use the Aenus-ALCAR nu scheme, this is set by default
-        parameter_dictionary["neutrinos"] = "Aenus-ALCAR"
-        #equations and progenitors
-        parfiles = os.listdir(sim.par_path)
-        for parfile in parfiles:
-            check = all(item in ["NS_EOS", "Heger_model", "gravity", "gravitational_potential", "lapse_function"] for \
-                        item in parameter_dictionary.keys())
-            if check:
-                break
-            try:
-                namelist = f90nml.read(os.path.join(sim.par_path, parfile))
-                if 'SHENEOSPARS' in namelist:
-                    parameter_dictionary["NS_EOS"] = self.__polish_path(namelist['SHENEOSPARS']['SHEN_TBFILE'])
-                if 'HEGERPARS' in namelist:
-                    parameter_dictionary["Heger_model"] = self.__polish_path(namelist['HEGERPARS']['HEGER_MODEL'], remove_points = False)
-                    if 'omgadd' in namelist['HEGERPARS'] and not 'omgmult' in namelist['HEGERPARS']:
-                        parameter_dictionary["omega"] = namelist['HEGERPARS']['omgadd']
-                if 'PHYSSYST' in namelist:
-                    if namelist['PHYSSYST']['RELATIVISTIC']:
-                        parameter_dictionary["gravity"] = 'Pseudo-relativistic'
-                    else:
-                        parameter_dictionary["gravity"] = 'Newtonian'
-                if 'GRAVPARS' in namelist:
-                    parameter_dictionary["gravitational_potential"] = namelist['GRAVPARS']['MDPOT']
-                    parameter_dictionary["lapse_function"] = namelist['GRAVPARS']['LAPSE_FORM']
-                if 'AXIVECPOTPARS' in namelist:
-                    if 'b0' in namelist['AXIVECPOTPARS'] and 'bt' in namelist['AXIVECPOTPARS']:
-                        if namelist['AXIVECPOTPARS']['b0'] !=0 and namelist['AXIVECPOTPARS']['bt'] !=0:
-                            parameter_dictionary["magnetic_fields"] = True
-                            parameter_dictionary["poloidal_b_field"] = namelist['AXIVECPOTPARS']['b0']
-                            parameter_dictionary["toroidal_b_field"] = namelist['AXIVECPOTPARS']['bt']
-            except:
-                continue
-        if not "NS_EOS" in parameter_dictionary.keys():
-            parameter_dictionary["NS_EOS"] = "Access denied"
-            
-        if not "Heger_model" in parameter_dictionary.keys():
-            run_parfiles = os.listdir(os.path.join(sim.par_path, '.run'))
-            for parfile in run_parfiles:
-                if "Heger_model" in parameter_dictionary.keys():
-                    break
-                try:
-                    namelist = f90nml.read(os.path.join(sim.par_path, '.run', parfile))
-                    if 'HEGERPARS' in namelist:
-                        parameter_dictionary["Heger_model"] = self.__polish_path(namelist['HEGERPARS']['HEGER_MODEL'])
-                        if 'omgadd' in namelist['HEGERPARS'] and not 'omgmult' in namelist['HEGERPARS']:
-                            parameter_dictionary["omega"] = namelist['HEGERPARS']['omgadd']
-                    if 'AXIVECPOTPARS' in namelist:
-                        if 'b0' in namelist['AXIVECPOTPARS'] and 'bt' in namelist['AXIVECPOTPARS']:
-                            if namelist['AXIVECPOTPARS']['b0'] !=0 and namelist['AXIVECPOTPARS']['bt'] !=0:
-                                parameter_dictionary["magnetic_fields"] = True
-                                parameter_dictionary["poloidal_b_field"] = namelist['AXIVECPOTPARS']['b0']
-                                parameter_dictionary["toroidal_b_field"] = namelist['AXIVECPOTPARS']['bt']
-                except:
-                    continue
-        if not "Heger_model" in parameter_dictionary.keys():
-            parameter_dictionary["Heger_model"] = "original parfile not found"
-        #time
-        parameter_dictionary["bounce_time"] = sim.time_of_bounce_rho()
-        file_list = sim.file_list_hdf()
-        err = True
-        i = -1
-        while err and i>-len(file_list):
-            try:
-                data_h5 = sim.open_h5(file_list[i])
-                parameter_dictionary["total_time"] = sim.time(data_h5)[0]
-                sim.close_h5(data_h5)
-                err = False
-            except:
-                i -= 1
-                parameter_dictionary["comment"] = "Unable to open last hdf file(s)"
-        if err:
-            parameter_dictionary["comment"] = "Unable to open last hdf file(s)"
-        data_h5 = sim.open_h5(file_list[0])
-        #omega and b fields
-        if not "poloidal_b_field" in parameter_dictionary.keys() and \
-            not "toroidal_b_field" in parameter_dictionary.keys():
-            try:
-                b_field_pol = sim.poloidal_magnetic_field(data_h5)
-                b_field_tor = sim.toroidal_magnetic_field(data_h5)
-                parameter_dictionary["magnetic_fields"] = True
-                if sim.dim == 1:
-                    parameter_dictionary["poloidal_b_field"] = (b_field_pol).max()
-                    parameter_dictionary["toroidal_b_field"] = (b_field_tor).max()
-                elif sim.dim == 2:
-                    parameter_dictionary["poloidal_b_field"] = (b_field_pol.mean(axis = 0)).max()
-                    parameter_dictionary["toroidal_b_field"] = (b_field_tor.mean(axis = 0)).max()
-                else:
-                    parameter_dictionary["poloidal_b_field"] = (b_field_pol.mean(axis = (0,1))).max()
-                    parameter_dictionary["toroidal_b_field"] = (b_field_tor.mean(axis = (0,1))).max()
-            except:
-                parameter_dictionary["magnetic_fields"] = False
-        if "poloidal_b_field" in parameter_dictionary.keys() and \
-            "toroidal_b_field" in parameter_dictionary.keys():
-            if parameter_dictionary["poloidal_b_field"] == 0 and parameter_dictionary["toroidal_b_field"] == 0:
-                parameter_dictionary["magnetic_fields"] = False
-                del parameter_dictionary["poloidal_b_field"]
-                del parameter_dictionary["toroidal_b_field"]
-        
-        if not "omega" in parameter_dictionary.keys():
-            try:
-                omg = sim.omega(data_h5)
-                if sim.dim == 1:
-                    parameter_dictionary["omega"] = (omg).max()
-                elif sim.dim == 2:
-                    parameter_dictionary["omega"] = (omg.mean(axis = 0)).max()
-                else:
-                    parameter_dictionary["omega"] = (omg.mean(axis = (0,1))).max()
-            except:
-                    parameter_dictionary["omega"] = 0
-            if parameter_dictionary["omega"] < 1e-5:
-                parameter_dictionary["omega"] = 0
-        sim.close_h5(data_h5)
-        #dates
-        min_date = datetime.date.fromtimestamp(pathlib.Path(os.path.join(sim.hdf_path, file_list[0])).stat().st_mtime)
-        max_date = datetime.date.fromtimestamp(pathlib.Path(os.path.join(sim.hdf_path, file_list[0])).stat().st_mtime)
-        for file in file_list[1:]:
-            tmp_date = datetime.date.fromtimestamp(pathlib.Path(os.path.join(sim.hdf_path, file)).stat().st_mtime)
-            if tmp_date > max_date:
-                max_date = tmp_date
-            if tmp_date < min_date:
-                min_date = tmp_date
-        parameter_dictionary["simulation_started"] = min_date.strftime('%d/%m/%Y')
-        parameter_dictionary["simulation_ended"] = max_date.strftime('%d/%m/%Y')
-        parameter_dictionary["nucleosynthesis_computed"] = ""
-        return self.__sort_keywords(parameter_dictionary)
+        simulation = self.__catalog.get(folder, path)
+        if simulation is None:
+            return None
+        if "access" in simulation.keys() or simulation["Heger_model"] == "original parfile not found":
+            self.__catalog.delete(folder, path)
+            return None
+        return simulation
 
     def __save_catalog(self):
-        self.__catalog = json.dumps(self.__catalog, indent=4)
-        with open(self.__save_path, 'w') as outfile:
-            outfile.write(self.__catalog)
+        """
+        Saves the catalog. The first save writes the whole catalog, the
+        following ones only the entries changed in the meantime.
+        """
+        assert not self.__discover_only, "A catalog opened to discover simulations only MUST NOT be saved"
+        upserted, deleted = self.__catalog.pop_changes()
+        if self.__synced:
+            self.__storage.commit(self.__catalog, upserted, deleted)
+        else:
+            self.__storage.save(self.__catalog)
+            self.__synced = True
         with open(self.__save_README, 'w') as readme:
             readme.write("Thank you for creating a CCSN catalog using this Python script!!\n" + \
                           "Please pay attention to the following points:\n" + \
@@ -306,33 +427,194 @@ class catalog:
                           "\n\n\nGrazie per l'attenzione ;-P")
         
 
-    def __check_folder_for_simulations(self, path):
-        try:
-            dirs = self.__remove_redundant_folders(os.listdir(path))
-        except:
-            return None
-        for folder in dirs:
-            path_subfolder = os.path.join(path, folder)
-            print('\t', path_subfolder)
-            try:
-                subfolders = self.__remove_redundant_folders(os.listdir(path_subfolder))
-            except:
-                continue
-            if 'outp-hdf' in subfolders:
+    def __extract_simulations(self, simulations):
+        """
+        Extracts the parameters of the discovered simulations, either one at a
+        time or in a pool of worker processes fed while the discovery goes on.
+        The cost of the simulations to extract is estimated from their
+        metadata in a pool of threads, and the largest simulation of a look-ahead window of
+        4 x workers is submitted first, so that a huge simulation does not
+        finish last while the other workers are idle.
+        Entries are still appended in discovery order, independently of the
+        order in which the workers finish. If a worker dies (e.g. killed when
+        running out of memory), the pool is recreated and the simulations that
+        were in flight are retried one at a time in a process of their own, so
+        that only the one killing its worker is stored as failed.
+        When the build is checkpointed,
+        each result is recorded as soon as it is ready, and the simulations
+        completed before an interruption are taken from the checkpoint.
+        """
+        extract = extract_simulation if self.__profiler is None else profiled_extraction
+        if self.__workers == 1:
+            for folder, path, previous_entry in simulations:
+                if self.__resumed(folder, path, previous_entry):
+                    continue
+                result = extract(folder, path, previous_entry, self.__options)
+                self.__checkpoint_result(result, folder, path)
+                self.__store_entry(result, folder, path, previous_entry)
+            return
+        look_ahead = 4 * self.__workers
+        discovered, results, resumed, window, running = [], {}, set(), [], {}
+        #simulations in flight when a worker died, retried one at a time in a pool of their own
+        suspects, isolated = [], {}
+        pools = {"main": ProcessPoolExecutor(max_workers = self.__workers),
+                 "isolation": ProcessPoolExecutor(max_workers = 1)}
+        stored = 0
+        def submit(block):
+            nonlocal stored
+            #keeps the pool busy, and waits for it only when the window is full
+            while window and len(running) < 2 * self.__workers:
+                with profiling.stage('cost estimate'):
+                    largest = max(window, key = lambda item: item[1].result()["cost"])
+                try:
+                    running[pools["main"].submit(extract, *discovered[largest[0]], self.__options)] = largest[0]
+                except BrokenProcessPool:
+                    #the futures in flight tell which simulations to retry, if any
+                    if not running:
+                        pools["main"] = ProcessPoolExecutor(max_workers = self.__workers)
+                    break
+                window.remove(largest)
+            if suspects and not isolated:
                 try:
-                    if len(os.listdir(os.path.join(path_subfolder, 'outp-hdf'))) < 6:
+                    future = pools["isolation"].submit(extract, *discovered[suspects[0]], self.__options)
+                    isolated[future] = suspects.pop(0)
+                except BrokenProcessPool:
+                    pools["isolation"] = ProcessPoolExecutor(max_workers = 1)
+            futures = list(running) + list(isolated)
+            if futures and (block or len(window) >= look_ahead):
+                done, _ = wait(futures, return_when = FIRST_COMPLETED)
+            else:
+                done = [future for future in futures if future.done()]
+            for future in done:
+                if future in isolated:
+                    index = isolated.pop(future)
+                    if isinstance(future.exception(), BrokenProcessPool):
+                        #alone in its pool: this simulation killed the worker
+                        print("Worker died extracting", os.path.join(discovered[index][1], discovered[index][0]))
+                        pools["isolation"] = ProcessPoolExecutor(max_workers = 1)
+                elif future in running:
+                    if isinstance(future.exception(), BrokenProcessPool):
+                        print("Worker died, retrying the", len(running), "simulations in flight")
+                        suspects.extend(sorted(running.values()))
+                        running.clear()
+                        pools["main"].shutdown(wait = False)
+                        pools["main"] = ProcessPoolExecutor(max_workers = self.__workers)
                         continue
-                except:
-                    continue
-                
-                if self.__check_existence(folder, path):
+                    index = running.pop(future)
+                else:
+                    #already moved to the suspects by a broken pool
                     continue
-                try:
-                    self.__catalog.append(self.__read_simulations_parameters(folder, path))
-                except Exception as e:
-                    print("EXCEPTION:", e)
-                    self.__catalog.append({"name": folder, "location": path, "access": "denied"})
+                results[index] = self.__pool_result(future, *discovered[index])
+                self.__checkpoint_result(results[index], *discovered[index][:2])
+            stored = self.__store_ready(discovered, results, resumed, stored)
+
+        try:
+            with ThreadPoolExecutor(max_workers = self.__workers) as estimator:
+                for simulation in simulations:
+                    discovered.append(simulation)
+                    if self.__checkpoint is not None and self.__checkpoint.completed(*simulation[:2]):
+                        resumed.add(len(discovered) - 1)
+                    else:
+                        window.append((len(discovered) - 1, estimator.submit(self.__estimate, *simulation)))
+                    submit(False)
+                while window or running or suspects or isolated:
+                    submit(True)
+        finally:
+            for pool in pools.values():
+                pool.shutdown()
+        self.__store_ready(discovered, results, resumed, stored)
+
+    def __estimate(self, folder, path, previous_entry):
+        """
+        Cost of the extraction of a simulation. A refreshed simulation with
+        nothing to extract costs nothing, and is not estimated at all.
+        """
+        if previous_entry is not None and \
+            not pending_stages(previous_entry, simulation_fingerprint(folder, path), self.__options):
+            return {"cost": 0}
+        return estimate_cost(folder, path, previous_entry)
+
+    def __pool_result(self, future, folder, path, previous_entry):
+        try:
+            return future.result()
+        except Exception as e:
+            print("EXCEPTION:", e)
+            result = None if previous_entry is not None else \
+                {"name": folder, "location": path, "access": "denied"}
+            return result if self.__profiler is None else (result, {})
+
+    def __store_ready(self, discovered, results, resumed, stored):
+        """
+        Stores, in discovery order, the results ready after the first stored
+        simulations, the resumed ones being taken from the checkpoint.
+        Returns the number of simulations stored so far.
+        """
+        while stored < len(discovered) and (stored in results or stored in resumed):
+            folder, path, previous_entry = discovered[stored]
+            if stored in resumed:
+                self.__resumed(folder, path, previous_entry)
             else:
-                self.__check_folder_for_simulations(path_subfolder)
+                self.__store_entry(results.pop(stored), folder, path, previous_entry)
+            stored += 1
+        return stored
+
+    def __checkpoint_result(self, result, folder, path):
+        if self.__checkpoint is None:
+            return
+        self.__checkpoint.add(folder, path, result if self.__profiler is None else result[0])
+
+    def __resumed(self, folder, path, previous_entry):
+        """
+        Stores the entry of a simulation completed before the build was
+        interrupted. Returns False if the simulation is still to extract.
+        """
+        if self.__checkpoint is None or not self.__checkpoint.completed(folder, path):
+            return False
+        entry = self.__checkpoint.result(folder, path)
+        if entry is not None:
+            self.__catalog.insert(entry)
+            if previous_entry is not None:
+                self.__refreshed += 1
+        return True
+
+    def __store_entry(self, result, folder, path, previous_entry):
+        """
+        Adds a new entry, or replaces in place the entry it refreshes. When
+        profiling, result also holds the record of the extraction.
+        """
+        entry = result
+        if self.__profiler is not None:
+            entry, record = result
+            self.__profiler.add(os.path.join(path, folder), record)
+        if entry is None:
+            return
+        self.__catalog.insert(entry)
+        if previous_entry is not None:
+            self.__refreshed += 1
 
+    def __update_simulation(self, folder, path):
+        """
+        Adds a simulation, or refreshes it if already in the catalog.
+        Returns 1 if the catalog changed, 0 otherwise.
+        """
+        if self.__shard is not None and shard_of(folder, path, self.__shard[1]) != self.__shard[0]:
+            return 0
+        entry = extract_simulation(folder, path, self.__check_existence(folder, path), self.__options)
+        if entry is None:
+            return 0
+        self.__catalog.insert(entry)
+        return 1
 
+    def __new_simulations(self, simulations):
+        """
+        Filters the discovered simulations, keeping only the ones that are not
+        already in the catalog. In refresh mode, the simulations already in the
+        catalog are kept together with their entry, so that only the parameters
+        whose inputs changed are extracted again.
+        """
+        for folder, path in simulations:
+            previous_entry = self.__check_existence(folder, path)
+            if previous_entry is None:
+                yield folder, path, None
+            elif self.__refresh:
+                yield folder, path, previous_entry
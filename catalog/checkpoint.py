@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import sqlite3
+
+
+class build_checkpoint:
+    """
+    Progress of a build, stored in an SQLite database next to the catalog:
+    the simulations discovered so far in discovery order, whether the walk
+    of the paths was completed, and the result of every extraction already
+    done. Results are buffered and appended in a single transaction at most
+    every interval seconds, so a checkpoint never rewrites the catalog and
+    costs the same however large the catalog already is.
+    settings describes the build (paths, shard, ...): a checkpoint can only
+    be resumed by a build with the same settings.
+    """
+    def __init__(self, path, settings, interval = 60., resume = False):
+        self.path = path
+        self.interval = interval
+        settings = json.loads(json.dumps(settings))
+        if not resume:
+            self.remove()
+        self.__connection = sqlite3.connect(path)
+        self.__connection.execute("PRAGMA journal_mode = WAL")
+        self.__connection.execute("PRAGMA synchronous = NORMAL")
+        with self.__connection:
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS simulations (position INTEGER PRIMARY KEY, " + \
+                                      "name TEXT NOT NULL, location TEXT NOT NULL)")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS results (name TEXT NOT NULL, " + \
+                                      "location TEXT NOT NULL, data TEXT, PRIMARY KEY (name, location))")
+            stored = self.__state("settings")
+            if stored is None:
+                self.__connection.execute("INSERT INTO state (key, value) VALUES ('settings', ?)",
+                                          (json.dumps(settings),))
+        assert stored is None or json.loads(stored) == settings, \
+            "A build MUST be resumed with the same paths and options, found " + stored
+        self.simulations = [(name, location) for name, location in \
+                            self.__connection.execute("SELECT name, location FROM simulations ORDER BY position")]
+        self.discovery_complete = self.__state("discovery") == "complete"
+        self.__results = {(name, location): None if data is None else json.loads(data) \
+                          for name, location, data in \
+                          self.__connection.execute("SELECT name, location, data FROM results")}
+        self.__new_simulations = []
+        self.__new_results = []
+        self.__last_flush = time.monotonic()
+
+    def __len__(self):
+        return len(self.__results)
+
+    def discovered(self, simulations):
+        """
+        Yields the simulations recorded by the interrupted build, then the
+        ones of simulations not recorded yet, recording them. Once the walk
+        was completed, simulations is not iterated at all.
+        """
+        recorded = list(self.simulations)
+        yield from recorded
+        if self.discovery_complete:
+            return
+        known = set(recorded)
+        for simulation in simulations:
+            if simulation in known:
+                continue
+            known.add(simulation)
+            self.__new_simulations.append(simulation)
+            self.__flush_due()
+            yield simulation
+        self.discovery_complete = True
+        self.flush()
+
+    def completed(self, folder, path):
+        return (folder, path) in self.__results
+
+    def result(self, folder, path):
+        """
+        Entry extracted for a simulation, None if its previous entry was
+        left unchanged.
+        """
+        return self.__results[(folder, path)]
+
+    def add(self, folder, path, entry):
+        self.__results[(folder, path)] = entry
+        self.__new_results.append((folder, path, None if entry is None else json.dumps(entry)))
+        self.__flush_due()
+
+    def flush(self):
+        """
+        Appends the simulations discovered and the results added since the
+        last flush.
+        """
+        with self.__connection:
+            offset = self.__connection.execute("SELECT COUNT(*) FROM simulations").fetchone()[0]
+            self.__connection.executemany("INSERT INTO simulations (position, name, location) VALUES (?, ?, ?)",
+                                          ((offset + position, name, location) for position, (name, location) \
+                                           in enumerate(self.__new_simulations)))
+            self.__connection.executemany("INSERT OR REPLACE INTO results (name, location, data) VALUES (?, ?, ?)",
+                                          self.__new_results)
+            if self.discovery_complete:
+                self.__connection.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('discovery', 'complete')")
+        self.simulations.extend(self.__new_simulations)
+        self.__new_simulations = []
+        self.__new_results = []
+        self.__last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.__connection.close()
+
+    def remove(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def __flush_due(self):
+        if time.monotonic() - self.__last_flush >= self.interval:
+            self.flush()
+
+    def __state(self, key):
+        row = self.__connection.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
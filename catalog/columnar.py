@@ -0,0 +1,155 @@
+import os
+import json
+import numbers
+import numpy as np
+
+META_FILE = 'columns.json'
+
+
+def _field_order(entries):
+    """
+    Fields of all the entries, each one placed after the field preceding it
+    in the first entry having it, so that the order of the keys of the
+    entries is kept.
+    """
+    fields, known = [], set()
+    for entry in entries:
+        if known.issuperset(entry):
+            continue
+        position = 0
+        for key in entry:
+            if key not in known:
+                fields.insert(position, key)
+                known.add(key)
+            position = fields.index(key) + 1
+    return fields
+
+def _kind(values):
+    values = [value for value in values if value is not None]
+    #NumPy scalars (e.g. the float64 returned by the readers) count as numbers
+    if values and all(isinstance(value, (bool, np.bool_)) for value in values):
+        return 'bool'
+    if any(isinstance(value, (bool, np.bool_)) for value in values):
+        return 'json'
+    if values and all(isinstance(value, numbers.Integral) for value in values):
+        return 'int'
+    if values and all(isinstance(value, numbers.Real) for value in values):
+        return 'float'
+    if all(isinstance(value, str) for value in values):
+        return 'string'
+    #nested or mixed values (e.g. the fingerprint) are kept as JSON strings
+    return 'json'
+
+def write_columns(path, entries):
+    """
+    Writes the entries to the folder path as one .npy file per field:
+    int64, float64 (NaN when missing) and bool arrays for numbers and
+    booleans, int32 codes (-1 when missing) into a sorted dictionary for
+    strings. A <field>.present.npy mask is added to the fields missing from
+    some entries, and columns.json describes the fields.
+    """
+    entries = list(entries)
+    os.makedirs(path, exist_ok=True)
+    meta = {"size": len(entries), "fields": {}}
+    for field in _field_order(entries):
+        values = [entry.get(field) for entry in entries]
+        present = np.array([value is not None for value in values], dtype=bool)
+        kind = _kind(values)
+        if kind == 'int':
+            array = np.array([0 if value is None else value for value in values], dtype=np.int64)
+        elif kind == 'float':
+            array = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+        elif kind == 'bool':
+            array = np.array([bool(value) for value in values], dtype=bool)
+        else:
+            strings = [value if kind == 'string' or value is None else json.dumps(value) for value in values]
+            dictionary = np.array(sorted({string for string in strings if string is not None}), dtype=str)
+            codes = {string: code for code, string in enumerate(dictionary.tolist())}
+            array = np.array([-1 if string is None else codes[string] for string in strings], dtype=np.int32)
+            np.save(os.path.join(path, field + '.dictionary.npy'), dictionary)
+        np.save(os.path.join(path, field + '.npy'), array)
+        if not present.all():
+            np.save(os.path.join(path, field + '.present.npy'), present)
+        meta["fields"][field] = {"kind": kind, "missing": bool(not present.all())}
+    with open(os.path.join(path, META_FILE), 'w') as outfile:
+        json.dump(meta, outfile, indent=4)
+
+class columnar_catalog:
+    """
+    Catalog written by write_columns. Opening it only reads columns.json:
+    every column is memory-mapped the first time it is used, so loading
+    costs neither parsing nor copies.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as infile:
+            meta = json.load(infile)
+        self.size = meta["size"]
+        self.fields = meta["fields"]
+        self.__arrays = {}
+
+    def __len__(self):
+        return self.size
+
+    def kind(self, field):
+        return self.fields[field]["kind"]
+
+    def values(self, field):
+        """
+        Memory-mapped array of a field: the values of numbers and booleans,
+        the dictionary codes of strings.
+        """
+        return self.__array(field + '.npy')
+
+    def dictionary(self, field):
+        return self.__array(field + '.dictionary.npy')
+
+    def present(self, field):
+        """
+        Mask of the entries having the field.
+        """
+        if not self.fields[field]["missing"]:
+            return np.ones(self.size, dtype=bool)
+        return self.__array(field + '.present.npy')
+
+    def column(self, field):
+        """
+        Decoded values of a field, None where missing.
+        """
+        values, present = self.values(field).tolist(), self.present(field).tolist()
+        kind = self.kind(field)
+        if kind in ('string', 'json'):
+            dictionary = self.dictionary(field).tolist()
+            if kind == 'json':
+                dictionary = [json.loads(string) for string in dictionary]
+            values = [dictionary[code] if code >= 0 else None for code in values]
+        return [value if has_value else None for value, has_value in zip(values, present)]
+
+    def __iter__(self):
+        columns = {field: self.column(field) for field in self.fields}
+        for index in range(self.size):
+            yield {field: column[index] for field, column in columns.items() if column[index] is not None}
+
+    def to_pandas(self):
+        """
+        DataFrame of the catalog, with strings as categoricals built directly
+        on the dictionary codes and nested fields left out.
+        """
+        import pandas as pd
+        data = {}
+        for field in self.fields:
+            kind = self.kind(field)
+            if kind == 'json':
+                continue
+            if kind == 'string':
+                data[field] = pd.Categorical.from_codes(self.values(field), self.dictionary(field))
+            elif kind == 'bool' or (kind == 'int' and self.fields[field]["missing"]):
+                data[field] = pd.Series(self.values(field)).where(self.present(field))
+            else:
+                data[field] = self.values(field)
+        return pd.DataFrame(data)
+
+    def __array(self, file_name):
+        if file_name not in self.__arrays:
+            self.__arrays[file_name] = np.load(os.path.join(self.path, file_name), mmap_mode='r')
+        return self.__arrays[file_name]
@@ -0,0 +1,266 @@
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+REDUNDANT_FOLDERS = ('Initial_Models', 'EOS')
+
+
+def directory_key(stat_result):
+    """
+    Identifies a directory independently of the path used to reach it.
+    """
+    return (stat_result.st_dev, stat_result.st_ino)
+
+def shard_of(name, location, count):
+    """
+    Shard (from 0 to count - 1) of a simulation, from a hash of its location
+    and name, so that independent jobs split the simulations in the same way.
+    """
+    digest = hashlib.sha1((location + '\0' + name).encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+def has_enough_entries(path, threshold):
+    """
+    Counts the entries of a folder, stopping as soon as the threshold is
+    reached instead of listing the whole folder.
+    """
+    count = 0
+    with os.scandir(path) as entries:
+        for _ in entries:
+            count += 1
+            if count >= threshold:
+                return True
+    return False
+
+def scan_folder(path):
+    """
+    Returns the subfolders of a folder as DirEntry objects, sorted by name,
+    together with the set of the names of all its entries. The type of each
+    entry is taken from the DirEntry itself, so no extra stat is needed.
+    """
+    subfolders, names = [], set()
+    with os.scandir(path) as entries:
+        for entry in entries:
+            names.add(entry.name)
+            if entry.name in REDUNDANT_FOLDERS:
+                continue
+            try:
+                if entry.is_dir():
+                    subfolders.append(entry)
+            except OSError:
+                continue
+    subfolders.sort(key = lambda entry: entry.name)
+    return subfolders, names
+
+def _count_lines(path, block_size = 1 << 20):
+    lines = 0
+    try:
+        with open(path, 'rb') as infile:
+            for block in iter(lambda: infile.read(block_size), b''):
+                lines += block.count(b'\n')
+    except OSError:
+        return 0
+    return lines
+
+def _grid_size_exceeds(path, size):
+    """
+    Checks whether a grid file holds more than size values, reading only its
+    first lines: the test used by Tools.cell to find the dimension.
+    """
+    values = 0
+    try:
+        with open(path) as grid_file:
+            for line in grid_file:
+                if line.lstrip().startswith('#'):
+                    continue
+                values += len(line.split())
+                if values > size:
+                    return True
+    except OSError:
+        pass
+    return False
+
+def estimate_cost(name, location, previous_entry = None):
+    """
+    Estimates the cost of extracting a simulation from metadata only, without
+    opening any HDF5 file: number and total size of the snapshots, size of
+    the grid from the line counts of the grid files, and from them the
+    dimension. The grid size and the dimension of a previous entry of the
+    simulation are used instead of reading the grid files, when it has them.
+    The cost is a rough number of bytes read by the extraction: one snapshot
+    read entirely for the fields, the grid files parsed as text (about 100
+    bytes per line) and a few kB of metadata per snapshot for the timeline.
+    """
+    path = os.path.join(location, name)
+    snapshots, hdf_bytes = 0, 0
+    try:
+        with os.scandir(os.path.join(path, 'outp-hdf')) as entries:
+            for entry in entries:
+                #remove x00 files
+                if not entry.name.startswith('h'):
+                    continue
+                snapshots += 1
+                try:
+                    hdf_bytes += entry.stat().st_size
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    if previous_entry is not None and all(key in previous_entry for key in ("dimensions", "nx", "ny", "nz")):
+        dimensions = previous_entry["dimensions"]
+        grid_lines = [previous_entry["nx"], previous_entry["ny"], previous_entry["nz"]]
+    else:
+        grid_files = [os.path.join(path, 'grid', 'grid.' + axis + '.dat') for axis in 'xyz']
+        dimensions = 1 + sum(1 for grid_file in grid_files[1:] if _grid_size_exceeds(grid_file, 4))
+        grid_lines = [_count_lines(grid_file) for grid_file in grid_files]
+    return {"name": name, "location": location, "dimensions": dimensions,
+            "snapshots": snapshots, "hdf_bytes": hdf_bytes, "grid_lines": grid_lines,
+            "cost": (hdf_bytes // snapshots if snapshots > 0 else 0) + 100 * sum(grid_lines) + 4096 * snapshots}
+
+class prefetcher:
+    """
+    Lists folders ahead of the walk in a pool of at most concurrency threads,
+    so that several listings are in flight at once on filesystems with a
+    high metadata latency (NFS, Lustre). Every listed folder immediately
+    queues the listing of its own subfolders, unless its key was already
+    expanded through another path.
+    """
+    def __init__(self, concurrency, min_hdf_files):
+        self.min_hdf_files = min_hdf_files
+        self.__pool = ThreadPoolExecutor(max_workers = concurrency)
+        self.__expanded = set()
+        self.__lock = threading.Lock()
+
+    def submit(self, path, subfolders):
+        """
+        Returns the (entry, future) pairs of the listings of the subfolders.
+        """
+        return [(entry, self.__pool.submit(self.__probe, os.path.join(path, entry.name), entry)) \
+                for entry in subfolders]
+
+    def close(self):
+        self.__pool.shutdown(wait = True, cancel_futures = True)
+
+    def __probe(self, path, entry):
+        """
+        Returns the key of the folder, its subfolders, whether it is a
+        simulation (None if it has no outp-hdf folder) and the listings of its
+        subfolders (None if not queued), or None if it cannot be read.
+        """
+        try:
+            key = directory_key(entry.stat())
+            subfolders, names = scan_folder(path)
+        except OSError:
+            return None
+        if 'outp-hdf' in names:
+            try:
+                simulation = has_enough_entries(os.path.join(path, 'outp-hdf'), self.min_hdf_files)
+            except OSError:
+                simulation = False
+            return key, subfolders, simulation, None
+        with self.__lock:
+            expand = key not in self.__expanded
+            self.__expanded.add(key)
+        children = None
+        if expand:
+            try:
+                children = self.submit(path, subfolders)
+            except RuntimeError:
+                #the walk was closed
+                pass
+        return key, subfolders, None, children
+
+def find_simulations(paths, min_hdf_files = 6, visited = None, verbose = True, concurrency = 1):
+    """
+    Walks the given paths looking for simulations, i.e. folders containing
+    an outp-hdf folder with at least min_hdf_files entries. The walk is
+    iterative and depth first, and every folder is listed only once.
+    Folders already visited, either through a symlink loop or through
+    overlapping paths, are skipped.
+    With concurrency > 1, up to concurrency folders are listed at the same
+    time ahead of the walk, which still yields the same simulations in the
+    same order.
+    Yields (name, location) pairs as soon as each simulation is found.
+    """
+    if type(paths) == str:
+        paths = [paths]
+    if visited is None:
+        visited = set()
+    if concurrency > 1:
+        yield from _find_simulations_concurrent(paths, min_hdf_files, visited, verbose, concurrency)
+        return
+    for root in paths:
+        try:
+            key = directory_key(os.stat(root))
+            if key in visited:
+                continue
+            visited.add(key)
+            stack = [(root, scan_folder(root)[0])]
+        except OSError:
+            continue
+        while stack:
+            path, subfolders = stack.pop()
+            children = []
+            for entry in subfolders:
+                path_subfolder = os.path.join(path, entry.name)
+                if verbose:
+                    print('\t', path_subfolder)
+                try:
+                    key = directory_key(entry.stat())
+                    if key in visited:
+                        continue
+                    visited.add(key)
+                    grand_children, names = scan_folder(path_subfolder)
+                except OSError:
+                    continue
+                if 'outp-hdf' in names:
+                    try:
+                        if has_enough_entries(os.path.join(path_subfolder, 'outp-hdf'), min_hdf_files):
+                            yield entry.name, path
+                    except OSError:
+                        pass
+                else:
+                    children.append((path_subfolder, grand_children))
+            stack.extend(reversed(children))
+
+def _find_simulations_concurrent(paths, min_hdf_files, visited, verbose, concurrency):
+    """
+    Same walk as find_simulations, taking the listings from a prefetcher.
+    The visited folders are still checked in the order of the sequential
+    walk, so the same path wins when a folder is reachable more than once.
+    """
+    folders = prefetcher(concurrency, min_hdf_files)
+    try:
+        for root in paths:
+            try:
+                key = directory_key(os.stat(root))
+                if key in visited:
+                    continue
+                visited.add(key)
+                stack = [(root, folders.submit(root, scan_folder(root)[0]))]
+            except OSError:
+                continue
+            while stack:
+                path, probes = stack.pop()
+                children = []
+                for entry, future in probes:
+                    path_subfolder = os.path.join(path, entry.name)
+                    if verbose:
+                        print('\t', path_subfolder)
+                    result = future.result()
+                    if result is None:
+                        continue
+                    key, grand_children, simulation, listings = result
+                    if key in visited:
+                        continue
+                    visited.add(key)
+                    if simulation is None:
+                        if listings is None:
+                            listings = folders.submit(path_subfolder, grand_children)
+                        children.append((path_subfolder, listings))
+                    elif simulation:
+                        yield entry.name, path
+                stack.extend(reversed(children))
+    finally:
+        folders.close()
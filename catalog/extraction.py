@@ -0,0 +1,449 @@
+import os
+from Tools.parameters import read_namelist
+from Tools import profiling
+import datetime
+from fingerprint import simulation_fingerprint, changed_stages
+
+
+BACKENDS = ("auto", "scidata", "tools")
+_analysis_classes = {}
+
+
+def analysis_backend(backend = "auto"):
+    """
+    Returns the SimulationAnalysis class of the chosen backend, importing it
+    (and with it h5py and numpy) only the first time it is needed: "scidata"
+    for scidata.quantities, "tools" for the bundled Tools, "auto" for
+    scidata when installed and the bundled Tools otherwise.
+    """
+    assert backend in BACKENDS, "The analysis backend MUST be one of " + str(BACKENDS)
+    if backend not in _analysis_classes:
+        if backend == "tools":
+            from Tools.Tools import SimulationAnalysis
+        elif backend == "scidata":
+            from scidata.quantities.quantities import SimulationAnalysis
+        else:
+            try:
+                from scidata.quantities.quantities import SimulationAnalysis
+            except ImportError as e:
+                #only a missing scidata falls back, a broken installation is reported
+                if e.name is None or e.name.split('.')[0] != 'scidata':
+                    raise
+                from Tools.Tools import SimulationAnalysis
+        _analysis_classes[backend] = SimulationAnalysis
+    return _analysis_classes[backend]
+
+def polish_path(string, remove_bars = True, remove_points = True):
+    if remove_bars:
+        while string.find('/') != -1:
+            string = string[string.find('/')+1:]
+    if remove_points:
+        while string.find('.') != -1:
+            string = string[:string.find('.')]
+    return string
+
+def sort_keywords(dictionary):
+    """
+    Sorts the keys of a single simulation dictionary.
+    """
+
+    if not dictionary.get("magnetic_fields"):
+        keys = ["name", "location", "dimensions", "NS_EOS", "Heger_model", "gravity", "neutrinos",
+                "gravitational_potential", "lapse_function", "total_time", "bounce_time", "inner_dr", 
+                "nx", "ny", "nz", "omega", "magnetic_fields", "simulation_started", "simulation_ended", 
+                "nucleosynthesis_computed"]
+    else:
+        keys = ["name", "location", "dimensions", "NS_EOS", "Heger_model", "gravity", "neutrinos",
+            "gravitational_potential", "lapse_function", "total_time", "bounce_time", "inner_dr", 
+            "nx", "ny", "nz", "omega", "magnetic_fields", "poloidal_b_field", "toroidal_b_field",
+            "simulation_started", "simulation_ended", "nucleosynthesis_computed"]
+
+    #fields left for later by the fast mode are missing until filled
+    deferred = dictionary.get("deferred", [])
+    keys = [key for key in keys if key in dictionary or key not in deferred]
+    if "comment" in dictionary.keys():
+        keys.append("comment")
+    if "deferred" in dictionary.keys():
+        keys.append("deferred")
+    if "total_time_estimated" in dictionary.keys():
+        keys.append("total_time_estimated")
+    if "time_index" in dictionary.keys():
+        keys.append("time_index")
+    if "evolution" in dictionary.keys():
+        keys.append("evolution")
+    if "extracted" in dictionary.keys():
+        keys.append("extracted")
+    if "fingerprint" in dictionary.keys():
+        keys.append("fingerprint")
+    return {key: dictionary[key] for key in keys}
+
+STAGES = ("grid", "parfiles", "bounce", "time", "fields", "dates")
+
+#paths of the sidecar files written in the folders of a build, which are not shared with other catalogs
+SIDECAR_KEYWORDS = ("time_index", "evolution")
+
+UNREADABLE_COMMENT = "Unable to open last hdf file(s)"
+
+#parameters only known from the HDF5 outputs, unless given in the parfiles
+DEFERRED_STAGES = ("parfiles", "fields")
+
+STAGE_KEYWORDS = {"grid": ["dimensions", "inner_dr", "nx", "ny", "nz"],
+                  "parfiles": ["neutrinos", "NS_EOS", "Heger_model", "gravity", "gravitational_potential",
+                               "lapse_function", "omega", "magnetic_fields", "poloidal_b_field",
+                               "toroidal_b_field"],
+                  "bounce": ["bounce_time"],
+                  "time": ["total_time", "total_time_estimated", "comment", "time_index", "evolution"],
+                  "fields": ["omega", "magnetic_fields", "poloidal_b_field", "toroidal_b_field", "deferred"],
+                  "dates": ["simulation_started", "simulation_ended"]}
+
+def read_simulations_parameters(folder, simulation_path, stages = STAGES, parameters = None,
+                                options = None):
+    """
+    Extracts the parameters of a simulation. Only the selected stages are
+    run; the keywords of the other stages are taken from parameters, i.e.
+    a previous entry of the same simulation. options holds the settings of
+    the build (e.g. the analysis backend, the memory budget of the chunked
+    readers, the folder of the grid cache, of the snapshot time indexes or
+    of the time evolution series).
+    With options["fast"] no HDF5 file is opened: the total time is the
+    latest time of the density log, flagged as total_time_estimated, and the
+    omega and B fields not given in the parfiles are listed as deferred in
+    the entry instead of being read.
+    """
+    if options is None:
+        options = {}
+    with profiling.stage('fingerprint'):
+        fingerprint = simulation_fingerprint(folder, simulation_path)
+    with profiling.stage('SimulationAnalysis'):
+        sim = analysis_backend(options.get("backend", "auto"))(folder, simulation_folder_path = simulation_path)
+    if options.get("memory_budget") is not None:
+        sim.memory_budget = options["memory_budget"]
+    if options.get("grid_cache") is not None and hasattr(sim.cell, 'cache_dir'):
+        sim.cell.cache_dir = options["grid_cache"]
+    fast = options.get("fast", False)
+    parameter_dictionary = {} if parameters is None else dict(parameters)
+    if "parfiles" in stages and "fields" not in stages:
+        stages = tuple(stages) + ("fields",)
+    for stage in stages:
+        for key in STAGE_KEYWORDS[stage]:
+            parameter_dictionary.pop(key, None)
+    parameter_dictionary["name"] = folder
+    parameter_dictionary["location"] = simulation_path
+    if "grid" in stages:
+        with profiling.stage('grid'):
+            _read_grid(sim, parameter_dictionary)
+    if "parfiles" in stages:
+        with profiling.stage('parfiles'):
+            _read_parfiles(sim, parameter_dictionary)
+    if "bounce" in stages:
+        with profiling.stage('bounce'):
+            parameter_dictionary["bounce_time"] = sim.time_of_bounce_rho()
+    with profiling.stage('timeline'):
+        outputs = _timeline(sim)
+    if "time" in stages:
+        with profiling.stage('total_time'):
+            if fast:
+                parameter_dictionary["total_time"] = _latest_log_time(sim)
+                parameter_dictionary["total_time_estimated"] = True
+            else:
+                _read_total_time(outputs, parameter_dictionary)
+        if options.get("time_index") is not None and not fast:
+            with profiling.stage('time index'):
+                _update_time_index(parameter_dictionary, options)
+        if options.get("evolution") is not None and not fast:
+            with profiling.stage('evolution'):
+                _update_evolution(parameter_dictionary, options)
+    if "fields" in stages:
+        with profiling.stage('fields'):
+            if fast:
+                _defer_fields(parameter_dictionary)
+            else:
+                _read_fields(sim, outputs.file_list, parameter_dictionary)
+    if "dates" in stages:
+        with profiling.stage('dates'):
+            _read_dates(outputs, parameter_dictionary)
+    parameter_dictionary["nucleosynthesis_computed"] = parameter_dictionary.get("nucleosynthesis_computed", "")
+    parameter_dictionary["extracted"] = datetime.datetime.now().isoformat(timespec = 'seconds')
+    parameter_dictionary["fingerprint"] = fingerprint
+    return sort_keywords(parameter_dictionary)
+
+def _read_grid(sim, parameter_dictionary):
+    parameter_dictionary["dimensions"] = sim.dim
+    parameter_dictionary["inner_dr"] = sim.cell.dr(sim.ghost)[0]
+    parameter_dictionary["nx"] = sim.cell.radius(sim.ghost).size
+    parameter_dictionary["ny"] = 1
+    parameter_dictionary["nz"] = 1
+    if sim.dim > 1:
+        parameter_dictionary["ny"] = sim.cell.theta(sim.ghost).size
+        if sim.dim > 2:
+            parameter_dictionary["nz"] = sim.cell.phi(sim.ghost).size
+
+def _read_parfiles(sim, parameter_dictionary):
+    #Neutrino scheme: there is no flag for the neutrino scheme for now.
+    #Since most simulations use the Aenus-ALCAR nu scheme, this is set by default
+    parameter_dictionary["neutrinos"] = "Aenus-ALCAR"
+    #equations and progenitors
+    parfiles = os.listdir(sim.par_path)
+    for parfile in parfiles:
+        check = all(item in ["NS_EOS", "Heger_model", "gravity", "gravitational_potential", "lapse_function"] for \
+                    item in parameter_dictionary.keys())
+        if check:
+            break
+        try:
+            namelist = read_namelist(os.path.join(sim.par_path, parfile))
+            if namelist is None:
+                continue
+            if 'SHENEOSPARS' in namelist:
+                parameter_dictionary["NS_EOS"] = polish_path(namelist['SHENEOSPARS']['SHEN_TBFILE'])
+            if 'HEGERPARS' in namelist:
+                parameter_dictionary["Heger_model"] = polish_path(namelist['HEGERPARS']['HEGER_MODEL'], remove_points = False)
+                if 'omgadd' in namelist['HEGERPARS'] and not 'omgmult' in namelist['HEGERPARS']:
+                    parameter_dictionary["omega"] = float(namelist['HEGERPARS']['omgadd'])
+            if 'PHYSSYST' in namelist:
+                if namelist['PHYSSYST']['RELATIVISTIC']:
+                    parameter_dictionary["gravity"] = 'Pseudo-relativistic'
+                else:
+                    parameter_dictionary["gravity"] = 'Newtonian'
+            if 'GRAVPARS' in namelist:
+                parameter_dictionary["gravitational_potential"] = namelist['GRAVPARS']['MDPOT']
+                parameter_dictionary["lapse_function"] = namelist['GRAVPARS']['LAPSE_FORM']
+            if 'AXIVECPOTPARS' in namelist:
+                if 'b0' in namelist['AXIVECPOTPARS'] and 'bt' in namelist['AXIVECPOTPARS']:
+                    if namelist['AXIVECPOTPARS']['b0'] !=0 and namelist['AXIVECPOTPARS']['bt'] !=0:
+                        parameter_dictionary["magnetic_fields"] = True
+                        parameter_dictionary["poloidal_b_field"] = float(namelist['AXIVECPOTPARS']['b0'])
+                        parameter_dictionary["toroidal_b_field"] = float(namelist['AXIVECPOTPARS']['bt'])
+        except:
+            continue
+    if not "NS_EOS" in parameter_dictionary.keys():
+        parameter_dictionary["NS_EOS"] = "Access denied"
+
+    if not "Heger_model" in parameter_dictionary.keys():
+        run_parfiles = os.listdir(os.path.join(sim.par_path, '.run'))
+        for parfile in run_parfiles:
+            if "Heger_model" in parameter_dictionary.keys():
+                break
+            try:
+                namelist = read_namelist(os.path.join(sim.par_path, '.run', parfile),
+                                         ('HEGERPARS', 'AXIVECPOTPARS'))
+                if namelist is None:
+                    continue
+                if 'HEGERPARS' in namelist:
+                    parameter_dictionary["Heger_model"] = polish_path(namelist['HEGERPARS']['HEGER_MODEL'])
+                    if 'omgadd' in namelist['HEGERPARS'] and not 'omgmult' in namelist['HEGERPARS']:
+                        parameter_dictionary["omega"] = float(namelist['HEGERPARS']['omgadd'])
+                if 'AXIVECPOTPARS' in namelist:
+                    if 'b0' in namelist['AXIVECPOTPARS'] and 'bt' in namelist['AXIVECPOTPARS']:
+                        if namelist['AXIVECPOTPARS']['b0'] !=0 and namelist['AXIVECPOTPARS']['bt'] !=0:
+                            parameter_dictionary["magnetic_fields"] = True
+                            parameter_dictionary["poloidal_b_field"] = float(namelist['AXIVECPOTPARS']['b0'])
+                            parameter_dictionary["toroidal_b_field"] = float(namelist['AXIVECPOTPARS']['bt'])
+            except:
+                continue
+    if not "Heger_model" in parameter_dictionary.keys():
+        parameter_dictionary["Heger_model"] = "original parfile not found"
+
+def _timeline(sim):
+    if hasattr(sim, 'timeline'):
+        return sim.timeline()
+    from Tools.Tools import timeline
+    return timeline(sim.hdf_path)
+
+def _read_total_time(outputs, parameter_dictionary):
+    total_time = outputs.total_time()
+    if total_time is not None:
+        parameter_dictionary["total_time"] = total_time
+    if outputs.unreadable_files() > 0:
+        parameter_dictionary["comment"] = UNREADABLE_COMMENT
+
+def _latest_log_time(sim):
+    if hasattr(sim, 'rho_log'):
+        return sim.rho_log().latest_time()
+    from Tools.Tools import rho_log
+    return rho_log(os.path.join(sim.path, 'log', 'rho.dat')).latest_time()
+
+def _update_time_index(parameter_dictionary, options):
+    from Tools.snapshots import snapshot_index, index_file
+    hdf_path = os.path.join(parameter_dictionary["location"], parameter_dictionary["name"], 'outp-hdf')
+    index = snapshot_index(index_file(options["time_index"], hdf_path), hdf_path)
+    index.update(options.get("time_index_workers", 1))
+    parameter_dictionary["time_index"] = os.path.abspath(index.path)
+
+def _update_evolution(parameter_dictionary, options):
+    from Tools.evolution import evolution_series, series_file
+    hdf_path = os.path.join(parameter_dictionary["location"], parameter_dictionary["name"], 'outp-hdf')
+    series = evolution_series(series_file(options["evolution"], hdf_path), parameter_dictionary["name"],
+                              parameter_dictionary["location"], options.get("memory_budget"),
+                              options.get("backend", "auto"))
+    series.update(options.get("evolution_workers", 1), options.get("evolution_stride", 1))
+    parameter_dictionary["evolution"] = os.path.abspath(series.path)
+
+def _read_fields(sim, file_list, parameter_dictionary):
+    data_h5 = sim.open_h5(file_list[0])
+    #omega and b fields
+    if not "poloidal_b_field" in parameter_dictionary.keys() and \
+        not "toroidal_b_field" in parameter_dictionary.keys():
+        try:
+            b_field_pol = radial_profile(sim, 'poloidal_magnetic_field', data_h5)
+            b_field_tor = radial_profile(sim, 'toroidal_magnetic_field', data_h5)
+            parameter_dictionary["magnetic_fields"] = True
+            parameter_dictionary["poloidal_b_field"] = float(b_field_pol.max())
+            parameter_dictionary["toroidal_b_field"] = float(b_field_tor.max())
+        except:
+            parameter_dictionary["magnetic_fields"] = False
+    if "poloidal_b_field" in parameter_dictionary.keys() and \
+        "toroidal_b_field" in parameter_dictionary.keys():
+        if parameter_dictionary["poloidal_b_field"] == 0 and parameter_dictionary["toroidal_b_field"] == 0:
+            parameter_dictionary["magnetic_fields"] = False
+            del parameter_dictionary["poloidal_b_field"]
+            del parameter_dictionary["toroidal_b_field"]
+
+    if not "omega" in parameter_dictionary.keys():
+        try:
+            parameter_dictionary["omega"] = float(radial_profile(sim, 'omega', data_h5).max())
+        except:
+                parameter_dictionary["omega"] = 0.
+        if parameter_dictionary["omega"] < 1e-5:
+            parameter_dictionary["omega"] = 0.
+    sim.close_h5(data_h5)
+
+def _defer_fields(parameter_dictionary):
+    """
+    Fast mode counterpart of _read_fields: the fields that would have to be
+    read from the first snapshot are listed as deferred.
+    """
+    deferred = []
+    if not "poloidal_b_field" in parameter_dictionary.keys() and \
+        not "toroidal_b_field" in parameter_dictionary.keys():
+        deferred.extend(["magnetic_fields", "poloidal_b_field", "toroidal_b_field"])
+    if not "omega" in parameter_dictionary.keys():
+        deferred.append("omega")
+    if deferred:
+        parameter_dictionary["deferred"] = deferred
+
+def radial_profile(sim, quantity, data_h5):
+    """
+    Radial profile of a quantity averaged over the angles. The chunked reader
+    of the bundled Tools is used when available, otherwise the whole quantity
+    is loaded and averaged.
+    """
+    if hasattr(sim, 'angular_average'):
+        return sim.angular_average(quantity, data_h5)
+    data = getattr(sim, quantity)(data_h5)
+    if sim.dim == 1:
+        return data
+    elif sim.dim == 2:
+        return data.mean(axis = 0)
+    return data.mean(axis = (0,1))
+
+def _read_dates(outputs, parameter_dictionary):
+    min_date = datetime.date.fromtimestamp(outputs.first_mtime)
+    max_date = datetime.date.fromtimestamp(outputs.last_mtime)
+    parameter_dictionary["simulation_started"] = min_date.strftime('%d/%m/%Y')
+    parameter_dictionary["simulation_ended"] = max_date.strftime('%d/%m/%Y')
+
+def _missing_sidecar(entry, keyword, options):
+    """
+    True if the build writes the sidecar files referenced by keyword (e.g.
+    the time indexes) and the entry has none in the folder of the build.
+    """
+    if options.get(keyword) is None:
+        return False
+    path = entry.get(keyword)
+    return path is None or os.path.dirname(path) != os.path.abspath(options[keyword]) or \
+        not os.path.exists(path)
+
+def pending_stages(entry, fingerprint, options = None):
+    """
+    Stages to run again on an entry: the ones whose inputs changed since it
+    was created and, outside the fast mode, the ones it deferred, the time
+    stage if its total time was estimated from the density log, the time
+    and date stages while its last snapshots could not be read, and the
+    time stage if the sidecar files asked by the build are missing.
+    """
+    if options is None:
+        options = {}
+    stages = changed_stages(entry.get("fingerprint"), fingerprint)
+    if options.get("fast", False):
+        return stages
+    if entry.get("deferred"):
+        stages.extend(stage for stage in DEFERRED_STAGES if stage not in stages)
+    if entry.get("total_time_estimated") and "time" not in stages:
+        stages.append("time")
+    #truncated snapshots are usually completed in place, which changes neither the mtime nor the
+    #number of files of outp-hdf
+    if entry.get("comment") == UNREADABLE_COMMENT:
+        stages.extend(stage for stage in ("time", "dates") if stage not in stages)
+    if "time" not in stages and any(_missing_sidecar(entry, keyword, options) for keyword in SIDECAR_KEYWORDS):
+        stages.append("time")
+    return stages
+
+def refresh_simulation(entry, options = None):
+    """
+    Extracts again only the parameters whose inputs changed since the entry
+    was created, and the ones it deferred. Returns None if the simulation
+    did not change.
+    """
+    stages = pending_stages(entry, simulation_fingerprint(entry["name"], entry["location"]), options)
+    if not stages:
+        return None
+    return read_simulations_parameters(entry["name"], entry["location"], stages, entry, options)
+
+def cached_extraction(folder, simulation_path, previous_entry, options):
+    """
+    Extraction going through the cache shared by all the catalogs: a cached
+    entry with the same fingerprint is reused as is, otherwise only the
+    parameters whose inputs changed since the previous or the cached entry
+    are extracted, and the cache is updated. The sidecar files belong to
+    the catalog that wrote them: they are left out of the cache, and written
+    again in the folders of the build when it asks for them. As
+    refresh_simulation, returns None if the previous entry is still up to
+    date.
+    """
+    from cache import extraction_cache
+    cache = extraction_cache(options["cache"], options.get("cache_size", 512 * 1024 ** 2))
+    key = extraction_cache.key(folder, simulation_path)
+    fingerprint = simulation_fingerprint(folder, simulation_path)
+    if previous_entry is not None and not pending_stages(previous_entry, fingerprint, options):
+        return None
+    cached = cache.get(key)
+    if cached is not None:
+        #the same simulation may be reached through different paths by different catalogs
+        cached = {keyword: value for keyword, value in cached.items() if keyword not in SIDECAR_KEYWORDS}
+        cached.update(name = folder, location = simulation_path)
+        if not pending_stages(cached, fingerprint, options):
+            return cached
+    base = previous_entry if previous_entry is not None else cached
+    stages = STAGES if base is None else pending_stages(base, fingerprint, options)
+    entry = read_simulations_parameters(folder, simulation_path, stages, base, options)
+    cache.put(key, {keyword: value for keyword, value in entry.items() if keyword not in SIDECAR_KEYWORDS})
+    return entry
+
+def extract_simulation(folder, simulation_path, previous_entry = None, options = None):
+    """
+    Entry point of the extraction workers. It never raises: a simulation
+    that cannot be read becomes an access denied entry, so a single broken
+    run does not bring down the whole pool. When refreshing a previous entry,
+    a failure leaves the entry untouched.
+    """
+    try:
+        if options is not None and options.get("cache") is not None:
+            return cached_extraction(folder, simulation_path, previous_entry, options)
+        if previous_entry is not None:
+            return refresh_simulation(previous_entry, options)
+        return read_simulations_parameters(folder, simulation_path, options = options)
+    except Exception as e:
+        print("EXCEPTION:", e)
+        if previous_entry is not None:
+            return None
+        return {"name": folder, "location": simulation_path, "access": "denied"}
+
+def profiled_extraction(folder, simulation_path, previous_entry = None, options = None):
+    """
+    Same as extract_simulation, also returning the record of the time, bytes
+    read and files opened by each stage of the extraction.
+    """
+    record = {}
+    with profiling.profile(record):
+        entry = extract_simulation(folder, simulation_path, previous_entry, options)
+    return entry, record
@@ -0,0 +1,59 @@
+import os
+
+#Extraction stages that have to be run again when a part of the fingerprint changes
+FINGERPRINT_STAGES = {"outp-hdf": ("time", "dates"),
+                      "rho": ("bounce",),
+                      "pars": ("parfiles", "fields"),
+                      "grid": ("grid",)}
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def _folder_mtimes(path):
+    mtimes = {}
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    mtimes[entry.name] = entry.stat().st_mtime
+    except OSError:
+        pass
+    return mtimes
+
+def simulation_fingerprint(folder, simulation_path):
+    """
+    Cheap summary of the inputs of a simulation, made only of stat calls.
+    It is stored in the catalog entry and compared on refresh to find
+    out which parameters have to be extracted again.
+    """
+    path = os.path.join(simulation_path, folder)
+    hdf_path = os.path.join(path, 'outp-hdf')
+    try:
+        with os.scandir(hdf_path) as entries:
+            hdf_files = sum(1 for _ in entries)
+    except OSError:
+        hdf_files = 0
+    pars = _folder_mtimes(os.path.join(path, 'pars'))
+    pars.update({os.path.join('.run', name): mtime for name, mtime in \
+                 _folder_mtimes(os.path.join(path, 'pars', '.run')).items()})
+    return {"outp-hdf": [_mtime(hdf_path), hdf_files],
+            "rho": _mtime(os.path.join(path, 'log', 'rho.dat')),
+            "pars": pars,
+            "grid": [_mtime(os.path.join(path, 'grid', 'grid.' + axis + '.dat')) for axis in 'xyz']}
+
+def changed_stages(old_fingerprint, new_fingerprint):
+    """
+    Returns the extraction stages affected by the differences between two
+    fingerprints. Entries without a fingerprint are extracted again entirely.
+    """
+    if old_fingerprint is None:
+        return [stage for stages in FINGERPRINT_STAGES.values() for stage in stages]
+    stages = []
+    for key, key_stages in FINGERPRINT_STAGES.items():
+        if old_fingerprint.get(key) != new_fingerprint.get(key):
+            stages.extend(stage for stage in key_stages if stage not in stages)
+    return stages
@@ -0,0 +1,135 @@
+import re
+import datetime
+import numpy as np
+
+DATE_FIELDS = ("simulation_started", "simulation_ended")
+_CONDITION = re.compile(r'^\s*(\w+)\s*(>=|<=|!=|==|=|>|<|~)\s*(.*?)\s*$')
+
+
+def parse_condition(condition):
+    """
+    Splits a condition such as "omega>0.5", "NS_EOS=SFHo" or "Heger_model~s15"
+    into a (field, operator, value) tuple. The operators are =, !=, <, <=,
+    >, >= and ~ (substring).
+    """
+    if type(condition) == tuple:
+        return condition
+    match = _CONDITION.match(condition)
+    if match is None:
+        raise ValueError("Condition not recognized: " + condition)
+    field, operator, value = match.groups()
+    return field, '=' if operator == '==' else operator, value
+
+def _date_ordinal(value):
+    for date_format in ('%d/%m/%Y', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, date_format).date().toordinal()
+        except ValueError:
+            continue
+    raise ValueError("Date not recognized: " + str(value))
+
+class column:
+    """
+    A catalog field stored as a NumPy array. Numbers, booleans and dates are
+    kept as float arrays (NaN for missing values) together with a sorted
+    index, strings are dictionary-encoded.
+    """
+    def __init__(self, field, values):
+        self.field = field
+        present = [value is not None for value in values]
+        self.present = np.array(present, dtype=bool)
+        kinds = {type(value) for value in values if value is not None}
+        if field in DATE_FIELDS:
+            self.kind = 'date'
+            values = [_date_ordinal(value) if value is not None else np.nan for value in values]
+        elif kinds and kinds <= {bool}:
+            self.kind = 'bool'
+        elif kinds and all(issubclass(kind, (int, float)) and kind != bool for kind in kinds):
+            self.kind = 'number'
+        else:
+            self.kind = 'string'
+        if self.kind == 'string':
+            strings = np.array(['' if value is None else str(value) for value in values], dtype=str)
+            self.dictionary, self.codes = np.unique(strings, return_inverse=True)
+        else:
+            self.values = np.array([np.nan if value is None else float(value) for value in values])
+            self.order = np.argsort(self.values, kind='stable')
+            self.sorted_values = self.values[self.order]
+
+    def convert(self, value):
+        if self.kind == 'date':
+            return _date_ordinal(value)
+        if self.kind == 'bool':
+            return float(str(value).lower() in ('true', '1', 'yes', 'y'))
+        if self.kind == 'number':
+            return float(value)
+        return str(value)
+
+    def mask(self, operator, value):
+        """
+        Boolean mask of the entries satisfying the condition. Entries missing
+        the field never match.
+        """
+        if self.kind == 'string':
+            return self.__string_mask(operator, str(value)) & self.present
+        if operator == '~':
+            raise ValueError("Substring conditions need a string field: " + self.field)
+        value = self.convert(value)
+        if operator == '!=':
+            return ~self.__range_mask('=', value) & self.present
+        return self.__range_mask(operator, value)
+
+    def __range_mask(self, operator, value):
+        #only the non-NaN part of the sorted index can match
+        valid = int(np.count_nonzero(~np.isnan(self.sorted_values)))
+        sorted_values = self.sorted_values[:valid]
+        start, stop = {'=': (np.searchsorted(sorted_values, value, 'left'),
+                             np.searchsorted(sorted_values, value, 'right')),
+                       '<': (0, np.searchsorted(sorted_values, value, 'left')),
+                       '<=': (0, np.searchsorted(sorted_values, value, 'right')),
+                       '>': (np.searchsorted(sorted_values, value, 'right'), valid),
+                       '>=': (np.searchsorted(sorted_values, value, 'left'), valid)}[operator]
+        mask = np.zeros(self.values.size, dtype=bool)
+        mask[self.order[start:stop]] = True
+        return mask
+
+    def __string_mask(self, operator, value):
+        if operator == '~':
+            matching = np.flatnonzero(np.char.find(self.dictionary, value) >= 0)
+            return np.isin(self.codes, matching)
+        if operator not in ('=', '!='):
+            raise ValueError("Only =, != and ~ are allowed on string fields: " + self.field)
+        code = np.searchsorted(self.dictionary, value)
+        found = code < self.dictionary.size and self.dictionary[min(code, self.dictionary.size - 1)] == value
+        equal = self.codes == code if found else np.zeros(self.codes.size, dtype=bool)
+        return equal if operator == '=' else ~equal
+
+class catalog_index:
+    """
+    Columnar representation of the catalog entries, on which the conditions
+    are evaluated with vectorized operations. Columns are built on first use.
+    """
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self.__columns = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def column(self, field):
+        if field not in self.__columns:
+            self.__columns[field] = column(field, [entry.get(field) for entry in self.entries])
+        return self.__columns[field]
+
+    def select(self, conditions):
+        """
+        Returns the positions of the entries satisfying all the conditions.
+        """
+        mask = np.ones(len(self.entries), dtype=bool)
+        for condition in conditions:
+            field, operator, value = parse_condition(condition)
+            mask &= self.column(field).mask(operator, value)
+        return np.flatnonzero(mask)
+
+    def query(self, conditions):
+        return [self.entries[index] for index in self.select(conditions)]
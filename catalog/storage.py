@@ -0,0 +1,204 @@
+import os
+import json
+import shutil
+import sqlite3
+
+
+class json_storage:
+    """
+    Catalog stored as a single pretty-printed JSON list. Every save rewrites
+    the whole file, so it is mainly meant for export.
+    """
+    extension = '.json'
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        with open(self.path) as infile:
+            return json.load(infile)
+
+    def save(self, entries):
+        """
+        Writes the entries one at a time to a temporary file, which then
+        replaces the catalog, so a crash never leaves a truncated catalog.
+        The output is the same as json.dumps(entries, indent=4).
+        """
+        tmp_path = self.path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'w') as outfile:
+            separator = '[\n    '
+            for entry in entries:
+                outfile.write(separator + json.dumps(entry, indent=4).replace('\n', '\n    '))
+                separator = ',\n    '
+            outfile.write('[]' if separator == '[\n    ' else '\n]')
+        os.replace(tmp_path, self.path)
+
+    def commit(self, entries, upserted, deleted):
+        self.save(entries)
+
+class sqlite_storage:
+    """
+    Catalog stored in an SQLite database, one row per entry. Single entries
+    are inserted, updated and deleted in place within a transaction, without
+    rewriting the rest of the catalog.
+    """
+    extension = '.sqlite'
+
+    def __init__(self, path):
+        self.path = path
+
+    def __connect(self, path):
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE IF NOT EXISTS entries (name TEXT NOT NULL, " + \
+                           "location TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (name, location))")
+        return connection
+
+    def __len__(self):
+        connection = self.__connect(self.path)
+        try:
+            return connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        finally:
+            connection.close()
+
+    def load(self):
+        connection = self.__connect(self.path)
+        try:
+            for (data,) in connection.execute("SELECT data FROM entries ORDER BY rowid"):
+                yield json.loads(data)
+        finally:
+            connection.close()
+
+    def save(self, entries):
+        """
+        Writes the whole catalog to a new database, which then replaces the
+        previous one.
+        """
+        tmp_path = self.path + '.' + str(os.getpid()) + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = self.__connect(tmp_path)
+        try:
+            with connection:
+                self.__upsert(connection, entries)
+        finally:
+            connection.close()
+        os.replace(tmp_path, self.path)
+
+    def commit(self, entries, upserted, deleted):
+        """
+        Applies the entries inserted or updated and the (name, location) keys
+        deleted since the last save, in a single transaction.
+        """
+        connection = self.__connect(self.path)
+        try:
+            with connection:
+                connection.executemany("DELETE FROM entries WHERE name = ? AND location = ?", deleted)
+                self.__upsert(connection, upserted)
+        finally:
+            connection.close()
+
+    def merge(self, entries, prefer):
+        """
+        Adds the entries one at a time, keeping for each simulation already
+        present the entry returned by prefer(old, new).
+        """
+        connection = self.__connect(self.path)
+        try:
+            with connection:
+                for entry in entries:
+                    row = connection.execute("SELECT data FROM entries WHERE name = ? AND location = ?",
+                                             (entry["name"], entry["location"])).fetchone()
+                    if row is None or prefer(json.loads(row[0]), entry) is entry:
+                        self.__upsert(connection, [entry])
+        finally:
+            connection.close()
+
+    def __upsert(self, connection, entries):
+        connection.executemany("INSERT INTO entries (name, location, data) VALUES (?, ?, ?) " + \
+                               "ON CONFLICT (name, location) DO UPDATE SET data = excluded.data",
+                               ((entry["name"], entry["location"], json.dumps(entry)) for entry in entries))
+
+class columnar_storage:
+    """
+    Catalog stored as a folder of memory-mappable .npy columns, see
+    columnar.py, meant for analysis pipelines. Every save rewrites the
+    whole folder, and numpy is only imported when it is used.
+    """
+    extension = '.columns'
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        from columnar import columnar_catalog
+        return iter(columnar_catalog(self.path))
+
+    def save(self, entries):
+        """
+        Writes the columns to a temporary folder, which then replaces the
+        catalog.
+        """
+        from columnar import write_columns
+        tmp_path = self.path + '.' + str(os.getpid()) + '.tmp'
+        old_path = self.path + '.' + str(os.getpid()) + '.old'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        write_columns(tmp_path, entries)
+        if os.path.exists(self.path):
+            os.replace(self.path, old_path)
+        os.replace(tmp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    def commit(self, entries, upserted, deleted):
+        self.save(entries)
+
+STORAGES = {'json': json_storage, 'sqlite': sqlite_storage, 'columnar': columnar_storage}
+
+def open_storage(path, storage_format = None):
+    """
+    Returns the storage of a catalog file. If no format is given, it is
+    guessed from the extension of the file (or from it being a folder of
+    columns), defaulting to JSON.
+    """
+    if storage_format is None:
+        if os.path.splitext(path.rstrip(os.sep))[1] == '.columns' or os.path.isdir(path):
+            storage_format = 'columnar'
+        elif os.path.splitext(path)[1] in ('.sqlite', '.db'):
+            storage_format = 'sqlite'
+        else:
+            storage_format = 'json'
+    assert storage_format in STORAGES, "Storage format MUST be one of " + str(list(STORAGES))
+    return STORAGES[storage_format](path)
+
+def preferred_entry(old, new):
+    """
+    Chooses between two entries of the same simulation: an access denied
+    placeholder is always replaced, otherwise the most recently extracted
+    entry is kept, the new one if they are equally recent.
+    """
+    def rank(entry):
+        return ("access" not in entry, entry.get("extracted", ''))
+    return new if rank(new) >= rank(old) else old
+
+def merge_catalogs(paths, output_path, storage_format = None):
+    """
+    Merges the catalogs (e.g. the partial catalogs of a sharded build) into
+    a new catalog. The catalogs are read one entry at a time (one file at a
+    time for JSON ones) into a temporary SQLite database, so they are never
+    all in memory. Returns the number of entries of the merged catalog.
+    """
+    output = open_storage(output_path, storage_format)
+    merged = sqlite_storage(output_path + '.' + str(os.getpid()) + '.merge.tmp')
+    if os.path.exists(merged.path):
+        os.remove(merged.path)
+    try:
+        for path in paths:
+            merged.merge(open_storage(path).load(), preferred_entry)
+        size = len(merged)
+        if type(output) == sqlite_storage:
+            os.replace(merged.path, output_path)
+        else:
+            output.save(merged.load())
+    finally:
+        if os.path.exists(merged.path):
+            os.remove(merged.path)
+    return size
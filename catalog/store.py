@@ -0,0 +1,116 @@
+class catalog_store:
+    """
+    In-memory container of the catalog entries. Entries are indexed by
+    (name, location), with secondary indexes by name and by location, so
+    that lookups, insertions and deletions do not need to scan the whole
+    catalog. The insertion order of the entries is preserved.
+    The keys of the entries changed since the last call to pop_changes are
+    tracked, so that storages can save only those.
+    """
+    def __init__(self, entries = None):
+        self.__entries = {}
+        self.__by_name = {}
+        self.__by_location = {}
+        self.__upserted = set()
+        self.__deleted = set()
+        #incremented at every change, so that derived indexes know when to be rebuilt
+        self.version = 0
+        if entries is not None:
+            self.insert_many(entries)
+            self.pop_changes()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __iter__(self):
+        return iter(list(self.__entries.values()))
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def get(self, name, location, default = None):
+        return self.__entries.get((name, location), default)
+
+    def by_name(self, name):
+        return [self.__entries[key] for key in self.__by_name.get(name, {})]
+
+    def by_location(self, location):
+        return [self.__entries[key] for key in self.__by_location.get(location, {})]
+
+    def to_list(self):
+        return list(self.__entries.values())
+
+    def insert(self, entry):
+        """
+        Adds an entry to the store. An entry with the same name and location
+        is replaced, keeping its position.
+        """
+        key = (entry["name"], entry["location"])
+        self.__entries[key] = entry
+        self.__upserted.add(key)
+        self.__deleted.discard(key)
+        self.version += 1
+        self.__by_name.setdefault(key[0], {})[key] = None
+        self.__by_location.setdefault(key[1], {})[key] = None
+
+    def insert_many(self, entries):
+        for entry in entries:
+            self.insert(entry)
+
+    def update(self, name, location, values):
+        """
+        Updates the fields of an existing entry with the values dictionary.
+        """
+        entry = self.__entries[(name, location)]
+        entry.update(values)
+        self.__upserted.add((name, location))
+        self.version += 1
+        return entry
+
+    def update_many(self, updates):
+        """
+        Applies a batch of updates, given as ((name, location), values) pairs.
+        """
+        for (name, location), values in updates:
+            self.update(name, location, values)
+
+    def delete(self, name, location):
+        """
+        Removes an entry and returns it, or None if it is not in the store.
+        """
+        key = (name, location)
+        entry = self.__entries.pop(key, None)
+        if entry is None:
+            return None
+        self.__upserted.discard(key)
+        self.__deleted.add(key)
+        self.version += 1
+        self.__remove_from_index(self.__by_name, name, key)
+        self.__remove_from_index(self.__by_location, location, key)
+        return entry
+
+    def delete_many(self, keys):
+        """
+        Removes a batch of entries, given as (name, location) pairs, and
+        returns the number of entries removed.
+        """
+        return sum(self.delete(name, location) is not None for name, location in list(keys))
+
+    def delete_name(self, name):
+        return self.delete_many(list(self.__by_name.get(name, {})))
+
+    def pop_changes(self):
+        """
+        Returns the entries inserted or updated and the keys deleted since
+        the last call, and resets the tracking.
+        """
+        upserted = [self.__entries[key] for key in self.__entries if key in self.__upserted]
+        deleted = list(self.__deleted)
+        self.__upserted, self.__deleted = set(), set()
+        return upserted, deleted
+
+    def __remove_from_index(self, index, value, key):
+        keys = index[value]
+        del keys[key]
+        if not keys:
+            del index[value]
@@ -0,0 +1,282 @@
+import os
+import time
+import errno
+import heapq
+import select
+import struct
+import ctypes
+import ctypes.util
+from discovery import directory_key, has_enough_entries, scan_folder
+
+WATCH_MODES = ('auto', 'inotify', 'poll')
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_EVENT = struct.Struct('iIII')
+
+
+class inotify:
+    """
+    Minimal ctypes binding of the Linux inotify API, watching directories for
+    entries created, moved in or written. It only sees changes made on this
+    machine, so it is of no use on network filesystems written by other nodes.
+    """
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self.__libc = libc
+        self.__fd = fd
+        self.__paths = {}
+        self.__descriptors = {}
+
+    def add(self, path):
+        wd = self.__libc.inotify_add_watch(self.__fd, os.fsencode(path), _IN_CREATE | _IN_MOVED_TO | \
+                                           _IN_CLOSE_WRITE | _IN_ONLYDIR)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), path)
+        self.__paths[wd] = path
+        self.__descriptors[path] = wd
+
+    def discard(self, path):
+        wd = self.__descriptors.pop(path, None)
+        if wd is not None and self.__paths.pop(wd, None) is not None:
+            self.__libc.inotify_rm_watch(self.__fd, wd)
+
+    def read(self, timeout):
+        """
+        Waits up to timeout seconds for events and returns the set of the
+        watched directories in which something happened. All the events
+        already queued are read at once, so a burst gives a single set.
+        """
+        changed = set()
+        if not select.select([self.__fd], [], [], timeout)[0]:
+            return changed
+        while True:
+            try:
+                data = os.read(self.__fd, 1 << 16)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size + length
+                if mask & _IN_Q_OVERFLOW:
+                    changed.update(self.__paths.values())
+                elif mask & _IN_IGNORED:
+                    self.__descriptors.pop(self.__paths.pop(wd, None), None)
+                elif wd in self.__paths:
+                    changed.add(self.__paths[wd])
+
+    def close(self):
+        os.close(self.__fd)
+
+class poller:
+    """
+    Polling scheduler watching the modification time of directories, which
+    changes whenever an entry is created, renamed or deleted in them. Each
+    directory is polled with its own interval, doubled (up to max_interval)
+    every time it is found unchanged and reset when it changes, so that idle
+    folders cost fewer and fewer stats.
+    """
+    def __init__(self, interval = 10., max_interval = None):
+        self.interval = interval
+        self.max_interval = 32 * interval if max_interval is None else max_interval
+        self.__state = {}
+        self.__queue = []
+
+    def add(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        if path not in self.__state:
+            heapq.heappush(self.__queue, (time.monotonic() + self.interval, path))
+        self.__state[path] = [mtime, self.interval]
+
+    def discard(self, path):
+        self.__state.pop(path, None)
+
+    def read(self, timeout):
+        """
+        Polls the directories that are due within timeout seconds, returning
+        as soon as some of them changed, or after timeout seconds.
+        """
+        deadline = time.monotonic() + timeout
+        changed = set()
+        while not changed:
+            if not self.__queue or self.__queue[0][0] > deadline:
+                time.sleep(max(0., deadline - time.monotonic()))
+                return changed
+            time.sleep(max(0., self.__queue[0][0] - time.monotonic()))
+            now = time.monotonic()
+            while self.__queue and self.__queue[0][0] <= now:
+                _, path = heapq.heappop(self.__queue)
+                if path not in self.__state:
+                    continue
+                state = self.__state[path]
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except OSError:
+                    del self.__state[path]
+                    continue
+                if mtime != state[0]:
+                    changed.add(path)
+                    state[:] = [mtime, self.interval]
+                else:
+                    state[1] = min(2 * state[1], self.max_interval)
+                heapq.heappush(self.__queue, (now + state[1], path))
+        return changed
+
+    def close(self):
+        self.__state.clear()
+        self.__queue.clear()
+
+class tree_watcher:
+    """
+    Keeps track of the folders under the given paths and of the outp-hdf
+    folders of the simulations, reporting the simulations that appear and
+    the ones that get new snapshots. The folders are walked as in
+    find_simulations. Changes are detected with inotify where available
+    (mode 'auto' or 'inotify') and by polling otherwise (or with mode 'poll').
+    """
+    def __init__(self, paths, mode = 'auto', interval = 10., min_hdf_files = 6):
+        assert mode in WATCH_MODES, "The watch mode MUST be one of " + str(WATCH_MODES)
+        self.paths = [paths] if type(paths) == str else paths
+        self.min_hdf_files = min_hdf_files
+        self.__interval = interval
+        self.__visited = set()
+        self.__simulations = set()
+        #watched path -> ('folder', (name, location) of the folder, None for the roots) or
+        #('outp-hdf', (name, location) of the simulation owning it)
+        self.__watched = {}
+        self.__source = None
+        if mode != 'poll':
+            try:
+                self.__source = inotify()
+            except OSError as e:
+                if mode == 'inotify':
+                    raise
+                print("inotify not available (" + str(e) + "), polling instead.")
+        if self.__source is None:
+            self.__source = poller(interval)
+
+    def start(self):
+        """
+        Walks the paths, returning the (name, location) pairs of all the
+        simulations found.
+        """
+        found = []
+        for root in self.paths:
+            try:
+                key = directory_key(os.stat(root))
+                if key in self.__visited:
+                    continue
+                self.__visited.add(key)
+                self.__watch(root, 'folder', None)
+                found.extend(self.__walk(root, scan_folder(root)[0]))
+            except OSError:
+                continue
+        return found
+
+    def changes(self, timeout):
+        """
+        Waits up to timeout seconds for changes, returning the simulations
+        that are new or whose outp-hdf folder changed.
+        """
+        found = []
+        for path in sorted(self.__source.read(timeout)):
+            if path not in self.__watched:
+                continue
+            kind, simulation = self.__watched[path]
+            if kind == 'outp-hdf':
+                if self.__is_simulation(simulation, path):
+                    found.append(simulation)
+                continue
+            try:
+                subfolders, names = scan_folder(path)
+            except OSError:
+                continue
+            #a folder in which an outp-hdf folder was created becomes a simulation
+            if 'outp-hdf' in names and simulation is not None:
+                if self.__simulation_folder(path, simulation):
+                    found.append(simulation)
+            else:
+                found.extend(self.__walk(path, subfolders))
+        return list(dict.fromkeys(found))
+
+    def close(self):
+        self.__source.close()
+
+    def __walk(self, path, subfolders):
+        """
+        Depth first walk of the subfolders not visited yet, watching every
+        folder and outp-hdf folder met.
+        """
+        found = []
+        stack = [(path, subfolders)]
+        while stack:
+            path, subfolders = stack.pop()
+            children = []
+            for entry in subfolders:
+                path_subfolder = os.path.join(path, entry.name)
+                try:
+                    key = directory_key(entry.stat())
+                    if key in self.__visited:
+                        continue
+                    self.__visited.add(key)
+                    #watched before being listed, not to miss what is created in between
+                    self.__watch(path_subfolder, 'folder', (entry.name, path))
+                    grand_children, names = scan_folder(path_subfolder)
+                except OSError:
+                    continue
+                if 'outp-hdf' in names:
+                    if self.__simulation_folder(path_subfolder, (entry.name, path)):
+                        found.append((entry.name, path))
+                else:
+                    children.append((path_subfolder, grand_children))
+            stack.extend(reversed(children))
+        return found
+
+    def __simulation_folder(self, path, simulation):
+        """
+        Watches the outp-hdf folder of a simulation folder instead of the
+        folder itself. Simulations still having too few snapshots stay
+        watched until they have enough.
+        """
+        self.__watched.pop(path, None)
+        self.__source.discard(path)
+        path_hdf = os.path.join(path, 'outp-hdf')
+        self.__watch(path_hdf, 'outp-hdf', simulation)
+        return self.__is_simulation(simulation, path_hdf)
+
+    def __is_simulation(self, simulation, path_hdf):
+        if simulation in self.__simulations:
+            return True
+        try:
+            if has_enough_entries(path_hdf, self.min_hdf_files):
+                self.__simulations.add(simulation)
+                return True
+        except OSError:
+            pass
+        return False
+
+    def __watch(self, path, kind, simulation):
+        self.__watched[path] = (kind, simulation)
+        try:
+            self.__source.add(path)
+        except OSError as e:
+            if e.errno not in (errno.ENOSPC, errno.ENOMEM):
+                return
+            #too many inotify watches: everything is polled instead
+            print("inotify watch limit reached (" + str(e) + "), polling instead.")
+            self.__source.close()
+            self.__source = poller(self.__interval)
+            for watched in self.__watched:
+                self.__source.add(watched)